@@ -0,0 +1,88 @@
+import random
+import sqlite3
+import string
+
+from finalities.db import ConnectionPool
+from finalities.refcache import ReferenceCache
+
+# SQLite stand-in for the SomathesProducts MySQL database, with the same clients
+# and products tables. Connections behave like pymysql ones with a DictCursor, so
+# the pool, the reference cache and the resolvers run unchanged against it.
+
+CITIES = ['CASABLANCA', 'RABAT', 'FES', 'MARRAKECH', 'TANGER', 'AGADIR', 'OUJDA', 'MEKNES', 'KENITRA', 'TETOUAN']
+STORE_WORDS = ['ENTREPOT', 'HYPER', 'CENTRE', 'SAPINO', 'ANFA', 'AGDAL', 'SAISS', 'MENARA', 'IBN', 'BATOUTA',
+               'ZENITH', 'OCEAN', 'ATLAS', 'PALMIER', 'MASSIRA', 'NAKHIL', 'ANDALOUS', 'CALIFORNIE']
+
+
+class Cursor:
+    # pymysql DictCursor look-alike over a sqlite3 cursor
+
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cursor.close()
+
+    def execute(self, sql, args=None):
+        self.cursor.execute(sql.replace('%s', '?'), tuple(args or ()))
+
+    def fetchall(self):
+        columns = [column[0] for column in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+
+class Connection:
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return Cursor(self.connection)
+
+    def ping(self, reconnect=False):
+        self.connection.execute('SELECT 1')
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+def random_ean(rng):
+    return '611' + ''.join(rng.choice(string.digits) for _ in range(10))
+
+
+def seed_database(path, clients, products, seed=0):
+    # Create (or recreate) the clients and products tables with random rows.
+    # Returns (client Dens, product EANs) for the PDF generator to draw from.
+    rng = random.Random(seed)
+    dens = []
+    for number in range(clients):
+        words = ' '.join(rng.sample(STORE_WORDS, 2))
+        dens.append(f"MARJANE {words} {number} {rng.choice(CITIES)}")
+    eans = set()
+    while len(eans) < products:
+        eans.add(random_ean(rng))
+    eans = sorted(eans)
+
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('DROP TABLE IF EXISTS clients')
+        connection.execute('DROP TABLE IF EXISTS products')
+        connection.execute('CREATE TABLE clients (UID TEXT PRIMARY KEY, Den TEXT)')
+        connection.execute('CREATE TABLE products (EAN TEXT PRIMARY KEY, UID TEXT)')
+        connection.executemany('INSERT INTO clients VALUES (?, ?)',
+                               [(f"CBS{number:07d}", den) for number, den in enumerate(dens)])
+        connection.executemany('INSERT INTO products VALUES (?, ?)',
+                               [(ean, f"TP{number:08d}") for number, ean in enumerate(eans)])
+    connection.close()
+    return dens, eans
+
+
+def reference_cache(path, **limits):
+    # A ReferenceCache reading the stand-in database through a ConnectionPool
+    return ReferenceCache(ConnectionPool(lambda: Connection(path), **limits))
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pdfplumber
+from finalities import metrics
+from finalities.parsers import PARSERS, get_parser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from localdb import reference_cache, seed_database
+from synthetic_pdf import generate, lines_for_pages
+
+# End-to-end pipeline benchmark on synthetic purchase orders against a seeded
+# SQLite stand-in of the reference database. For every retailer it reports the
+# median time of each stage and the throughput, and can compare with a previous
+# run's JSON to catch regressions.
+#
+#   python benchmarks/pipeline.py --lines 40 400 --clients 2000 --products 20000 --save before.json
+#   python benchmarks/pipeline.py --lines 40 400 --clients 2000 --products 20000 --compare before.json
+#
+# Stages, from the finalities.metrics timers:
+#   extract   extract_tables() minus classification: opening the PDF and reading its tables
+#   classify  naming tables by header and building the DataFrames
+#   resolve   EAN -> UID mapping of the product lines
+#   match     fuzzy matching of the store against the clients
+#   export    the rest of export_order(): building and writing the Sage records
+
+STAGES = ('extract', 'classify', 'resolve', 'match', 'export')
+
+# Stages faster than this in the baseline are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.005
+
+
+def run_order(retailer, pdf_path, output_file, cache):
+    # Time one order through extraction and export; returns (stage seconds, counters)
+    parser = get_parser(retailer)
+    with metrics.measure() as measured:
+        start = time.perf_counter()
+        tables = parser.extract_tables(pdf_path)
+        extracted = time.perf_counter() - start
+        start = time.perf_counter()
+        parser.export_order(tables, output_file, cache)
+        exported = time.perf_counter() - start
+    timers = measured.timers
+    seconds = {
+        'extract': extracted - timers['classification'],
+        'classify': timers['classification'],
+        'resolve': timers['ean_resolve'],
+        'match': timers['fuzzy_match'],
+        'export': exported - timers['ean_resolve'] - timers['fuzzy_match'],
+    }
+    return seconds, dict(measured.counters)
+
+
+def page_count(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def run(orders, clients, products, repeat, work_dir, seed=0):
+    # orders: (retailer, line count) pairs to generate and time
+    database = os.path.join(work_dir, 'reference.sqlite')
+    dens, eans = seed_database(database, clients, products, seed)
+    cache = reference_cache(database)
+    start = time.perf_counter()
+    cache.products()
+    cache.client_index()
+    results = {'reference load': round(time.perf_counter() - start, 4)}
+
+    for retailer, lines in orders:
+        name = f"{retailer}-{lines}"
+        pdf_path = generate(retailer, os.path.join(work_dir, name + '.pdf'), lines, dens, eans, seed)
+        runs = [run_order(retailer, pdf_path, os.path.join(work_dir, name + '.csv'), cache) for _ in range(repeat)]
+        stages = {stage: round(statistics.median(seconds[stage] for seconds, _ in runs), 4) for stage in STAGES}
+        total = statistics.median(sum(seconds.values()) for seconds, _ in runs)
+        counters = runs[0][1]
+        written = counters.get('lines_written', 0)
+        results[name] = {
+            'retailer': retailer,
+            'lines': lines,
+            'pages': page_count(pdf_path),
+            'written_lines': written,
+            'stages': stages,
+            'total': round(total, 4),
+            'orders_per_second': round(1 / total, 2) if total else 0.0,
+            'lines_per_second': round(written / total, 1) if total else 0.0,
+            'counters': counters,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Stages now slower than the baseline by more than tolerance, as printable lines
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not isinstance(result, dict) or not isinstance(previous, dict):
+            continue
+        for stage in STAGES + ('total',):
+            old = previous['stages'].get(stage) if stage != 'total' else previous['total']
+            new = result['stages'][stage] if stage != 'total' else result['total']
+            if old is None or old < MIN_COMPARED_SECONDS:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{name} {stage}: {old:.4f}s -> {new:.4f}s (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_results(results):
+    print(f"reference load: {results['reference load']:.4f}s")
+    print(f"{'order':24} {'pages':>5} {'lines':>6} " + ' '.join(f"{stage:>9}" for stage in STAGES)
+          + f" {'total':>9} {'orders/s':>9} {'lines/s':>9}")
+    for name, result in results.items():
+        if not isinstance(result, dict):
+            continue
+        print(f"{name:24} {result['pages']:>5} {result['written_lines']:>6} "
+              + ' '.join(f"{result['stages'][stage]:>9.4f}" for stage in STAGES)
+              + f" {result['total']:>9.4f} {result['orders_per_second']:>9} {result['lines_per_second']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the order pipeline on synthetic purchase orders")
+    parser.add_argument('--retailer', action='append', choices=sorted(PARSERS),
+                        help="Retailer layout to benchmark, repeatable (default: all)")
+    parser.add_argument('--lines', type=int, nargs='+', default=[40, 400], help="Product lines per order")
+    parser.add_argument('--pages', type=int, nargs='+', help="Pages per order, instead of --lines")
+    parser.add_argument('--clients', type=int, default=1000, help="Clients in the stand-in database")
+    parser.add_argument('--products', type=int, default=10000, help="Products in the stand-in database")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per order, the median is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help="Keep the generated PDFs, database and outputs here")
+    parser.add_argument('--save', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--compare', default=None, help="Previous results JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before a stage is flagged")
+    args = parser.parse_args(argv)
+
+    retailers = args.retailer or sorted(PARSERS)
+    with ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(work_dir, exist_ok=True)
+        orders = [(retailer, lines) for retailer in retailers
+                  for lines in ([lines_for_pages(retailer, pages) for pages in args.pages] if args.pages else args.lines)]
+        results = run(orders, args.clients, args.products, args.repeat, work_dir, args.seed)
+
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'parameters': vars(args),
+                       'results': results}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No stage slower than {args.compare} by more than {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Startup budget check: imports every entry point in a fresh interpreter with
+# python -X importtime and fails when one takes longer than its budget, or loads
+# a heavy dependency it should only load on first use. Run it after touching
+# imports, like the pipeline benchmark:
+#
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --scale 2     # slower machine, looser time budgets
+#
+# Budgets are the best of --repeat runs, with room for machine noise. Parsers
+# have to import pandas (their tables are DataFrames); tabula, jpype, pdfplumber,
+# pymysql and fuzzywuzzy are imported by the functions that need them.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ('pandas', 'tabula', 'jpype', 'pdfplumber', 'pymysql', 'fuzzywuzzy')
+
+# module -> (milliseconds, heavy packages it may import)
+BUDGETS = {
+    'finalities.cli': (15, ()),
+    'finalities.convert': (60, ()),
+    'finalities.fingerprint': (60, ()),
+    'finalities.matchmemo': (40, ()),
+    'finalities.journal': (30, ()),
+    'finalities.snapshot': (40, ()),
+    'finalities.db': (30, ()),
+    'finalities.parsers.marjane': (600, ('pandas',)),
+    'finalities.parsers.labelvie': (600, ('pandas',)),
+    'finalities.parsers.vracmarjane': (750, ('pandas', 'pdfplumber')),
+    'finalities.batch': (650, ('pandas',)),
+    'finalities.daemon': (650, ('pandas',)),
+    'finalities.pipeline': (650, ('pandas',)),
+}
+
+
+def import_time(module):
+    # (cumulative import time in ms, top-level packages imported) of module in a fresh interpreter
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    packages = set()
+    milliseconds = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            milliseconds = int(cumulative) / 1000
+    return milliseconds, packages
+
+
+def check(modules, repeat, scale):
+    # Printable result lines and the number of budgets exceeded
+    lines = []
+    failures = 0
+    for module in modules:
+        budget, allowed = BUDGETS[module]
+        runs = [import_time(module) for _ in range(repeat)]
+        milliseconds = min(run[0] for run in runs)
+        unexpected = sorted(package for package in runs[0][1] if package in HEAVY and package not in allowed)
+        problems = []
+        if milliseconds > budget * scale:
+            problems.append(f"over budget of {budget * scale:.0f} ms")
+        if unexpected:
+            problems.append(f"imports {', '.join(unexpected)}")
+        failures += bool(problems)
+        lines.append(f"{module:34} {milliseconds:8.1f} ms  {'; '.join(problems) or 'ok'}")
+    return lines, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the import time of the finalities entry points")
+    parser.add_argument('modules', nargs='*', help="Modules to check (default: every budgeted module)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per module, the fastest is kept")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply every time budget by this")
+    args = parser.parse_args(argv)
+
+    lines, failures = check(args.modules or list(BUDGETS), args.repeat, args.scale)
+    for line in lines:
+        print(line)
+    if failures:
+        print(f"{failures} module(s) over their startup budget")
+        return 1
+    print("Every module within its startup budget")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,251 @@
+import random
+import zlib
+
+# Synthetic purchase orders in the Marjane, Marjane vrac and LabelVie layouts, at
+# any line count. The PDFs are written directly (Helvetica text and ruling lines,
+# no PDF library needed) with the table headers, regions and value formats the
+# parsers expect, so they go through the same extraction as the real samples.
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+FONT_SIZE = 7
+ROW_HEIGHT = 14
+# Lowest point a table row may reach, from the top of the page
+BODY_BOTTOM = 790
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+class Canvas:
+    # Pages of text and lines, in points from the top-left corner of the page
+
+    def __init__(self):
+        self.pages = []
+
+    def new_page(self):
+        self.pages.append([])
+
+    def text(self, x, top, text, size=FONT_SIZE):
+        # top is the top of the text line; PDF places text on its baseline
+        y = PAGE_HEIGHT - top - size
+        self.pages[-1].append(f"BT /F1 {size} Tf {x:.2f} {y:.2f} Td ({_escape(text)}) Tj ET")
+
+    def line(self, x0, top0, x1, top1):
+        self.pages[-1].append(f"{x0:.2f} {PAGE_HEIGHT - top0:.2f} m {x1:.2f} {PAGE_HEIGHT - top1:.2f} l S")
+
+    def table(self, x, top, widths, rows, row_heights=None, ruled=True):
+        # Draw rows of cells (a cell may hold several lines separated by '\n');
+        # returns the distance from the top of the page to the bottom of the table
+        row_heights = row_heights or [ROW_HEIGHT * max(cell.count('\n') + 1 for cell in row) for row in rows]
+        edges = [x]
+        for width in widths:
+            edges.append(edges[-1] + width)
+        row_top = top
+        for row, height in zip(rows, row_heights):
+            for left, cell in zip(edges, row):
+                for number, line in enumerate(cell.split('\n')):
+                    self.text(left + 2, row_top + 3 + number * ROW_HEIGHT, line)
+            if ruled:
+                self.line(edges[0], row_top, edges[-1], row_top)
+            row_top += height
+        if ruled:
+            self.line(edges[0], row_top, edges[-1], row_top)
+            for edge in edges:
+                self.line(edge, top, edge, row_top)
+        return row_top
+
+    def save(self, path):
+        # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+        objects = {
+            3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        }
+        kids = []
+        for index, commands in enumerate(self.pages):
+            page_id, content_id = 4 + 2 * index, 5 + 2 * index
+            kids.append(f"{page_id} 0 R")
+            stream = zlib.compress('\n'.join(['0.5 w'] + commands).encode('latin-1'))
+            objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+            objects[content_id] = (f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode()
+                                   + stream + b"\nendstream")
+        objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+        objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+        output = bytearray(b"%PDF-1.4\n")
+        offsets = {}
+        for number in sorted(objects):
+            offsets[number] = len(output)
+            output += f"{number} 0 obj\n".encode() + objects[number] + b"\nendobj\n"
+        xref = len(output)
+        output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+        for number in sorted(objects):
+            output += f"{offsets[number]:010d} 00000 n \n".encode()
+        output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+        with open(path, 'wb') as file:
+            file.write(output)
+        return path
+
+
+def order_lines(rng, eans, lines, unknown_ratio):
+    # (EAN, designation, quantity) per line, a share of the EANs missing from the catalog
+    rows = []
+    for _ in range(lines):
+        if eans and rng.random() >= unknown_ratio:
+            ean = rng.choice(eans)
+        else:
+            ean = '699' + ''.join(rng.choice('0123456789') for _ in range(10))
+        rows.append((ean, f"ARTICLE {rng.randint(1, 9999)} {rng.choice(['200 GR', '1 KG', '80GR', '6X1L'])}",
+                     rng.choice([1, 2, 5, 10, 25, 50, 100])))
+    return rows
+
+
+def _chunks(rows, first, rest):
+    # Split rows over pages holding `first` rows on page 1 and `rest` on the next ones
+    pages = [rows[:first]]
+    for start in range(first, len(rows), rest):
+        pages.append(rows[start:start + rest])
+    return pages
+
+
+def _capacity(top, header_rows=1):
+    return (BODY_BOTTOM - top) // ROW_HEIGHT - header_rows
+
+
+# Marjane portal: text header block, then a product table read by tabula's stream mode
+MARJANE_COLUMNS = [40, 115, 305, 365, 395, 440, 490]
+MARJANE_HEADER = ['Code Article', 'Libelle', 'Type Article', 'UA', 'UVC/UA', 'Qte Cmd UA', 'Qte Cmd UVC / Poids']
+MARJANE_FIRST_TOP = 173
+MARJANE_REST_TOP = 40
+MARJANE_ROW_HEIGHT = 16
+MARJANE_ROWS = ((BODY_BOTTOM - MARJANE_FIRST_TOP) // MARJANE_ROW_HEIGHT - 1,
+                (BODY_BOTTOM - MARJANE_REST_TOP) // MARJANE_ROW_HEIGHT - 1)
+
+
+def marjane(path, lines, site, eans, order_number, rng, unknown_ratio=0.05):
+    rows = order_lines(rng, eans, lines, unknown_ratio)
+    pages = _chunks(rows, *MARJANE_ROWS)
+    canvas = Canvas()
+    for number, page_rows in enumerate(pages, 1):
+        canvas.new_page()
+        if number == 1:
+            canvas.text(180, 28, 'Bon de Commade (Portail Marjane)', size=14)
+            for top, left, right in [(83, 'Fournisseur : 579, SOMATHES', 'Enseigne : MARJANE'),
+                                     (95, f'Commande : {order_number}', f'Site : {site}'),
+                                     (107, 'Date Commande : 11/07/2024', 'Code Site : 913'),
+                                     (119, 'Date Livraison Prevue : 16/07/2024', 'Utilisateur : 579_1')]:
+                canvas.text(40, top, left, size=8)
+                canvas.text(300, top, right, size=8)
+            canvas.text(40, 153, f'Total lignes : {lines}', size=8)
+        top = MARJANE_FIRST_TOP if number == 1 else MARJANE_REST_TOP
+        for x, title in zip(MARJANE_COLUMNS, MARJANE_HEADER):
+            canvas.text(x, top, title)
+        for index, (ean, designation, quantity) in enumerate(page_rows, 1):
+            values = [ean, designation, 'Piece/piece', 'PCB', '50', str(quantity), str(quantity * 50)]
+            for x, value in zip(MARJANE_COLUMNS, values):
+                canvas.text(x, top + index * MARJANE_ROW_HEIGHT, value)
+        canvas.text(540, 814, f'{number}/{len(pages)}')
+    return canvas.save(path)
+
+
+# Marjane vrac: ruled tables read by pdfplumber, headers without spaces
+VRAC_ORDER = (['Nocommande', 'Datecommande', 'Codefournisseur', 'Contratcommercial', 'Filiere', 'Etatcommande'],
+              [80, 80, 80, 90, 60, 95])
+VRAC_ORDERER = (['Commandepar', 'Livrea', 'Commandea'], [180, 180, 174])
+VRAC_PRODUCTS = (['Article', 'Libellearticle', 'VL', 'Noligne', 'TypeU.C.', 'Quanten\nUC', 'UVC/UC', 'Quanten\nUVC',
+                  'No.operation\nspeciale'], [65, 150, 25, 40, 45, 55, 40, 55, 80])
+VRAC_DELIVERY = (['Datedelivraisonsouhaitee', 'Datedelivraisonlimite'], [116, 116])
+VRAC_FIRST_TOP = 242
+VRAC_REST_TOP = 107
+# Rows on page 1 and on the next pages; the last page also needs room for the delivery table
+VRAC_ROWS = (_capacity(VRAC_FIRST_TOP, 2), _capacity(VRAC_REST_TOP, 2) - 4)
+
+
+def vracmarjane(path, lines, orderer, eans, order_number, rng, unknown_ratio=0.05):
+    rows = order_lines(rng, eans, lines, unknown_ratio)
+    pages = _chunks(rows, *VRAC_ROWS)
+    orderer_cell = orderer.replace(' ', '\n', 1)
+    canvas = Canvas()
+    line_number = 0
+    for number, page_rows in enumerate(pages, 1):
+        canvas.new_page()
+        canvas.text(230, 25, 'BONDECOMMANDE', size=12)
+        canvas.table(28, 60, VRAC_ORDER[1], [VRAC_ORDER[0],
+                                              [order_number, '11/07/2414:48', '579', '00579012', '1', 'Attentelivraison']])
+        if number == 1:
+            canvas.table(28, 123, VRAC_ORDERER[1], [VRAC_ORDERER[0], [orderer_cell, orderer_cell, 'SOMATHES\nCASABLANCA']])
+        table_rows = [VRAC_PRODUCTS[0]]
+        for ean, designation, quantity in page_rows:
+            line_number += 1
+            table_rows.append([ean, designation, '1', str(line_number), 'CAR', f'{quantity}.000', '1', f'{quantity}.000', ''])
+        bottom = canvas.table(28, VRAC_FIRST_TOP if number == 1 else VRAC_REST_TOP, VRAC_PRODUCTS[1], table_rows)
+        if number == len(pages):
+            canvas.table(28, bottom + 16, VRAC_DELIVERY[1], [VRAC_DELIVERY[0], ['16/07/2423:59', '16/07/2423:59']])
+    return canvas.save(path)
+
+
+# LabelVie: ruled tables read by tabula's lattice mode, headers with spaces
+LABELVIE_ORDER = (['No commande', 'Date commande', 'Code\nfournisseur', 'Contrat\ncommercial', 'Filiere'],
+                  [80, 80, 80, 80, 60])
+LABELVIE_ORDERER = (['Commande par', 'Livre a', 'Commande a'], [180, 180, 174])
+LABELVIE_PRODUCTS = (['Code\nexterne', 'Code EAN', 'Libelle article', 'Type\nU.C.', 'VL', 'No ligne', 'UVC/UC',
+                      'Quant en UC', 'No opera speci', 'ion le'], [45, 65, 130, 35, 20, 35, 40, 50, 70, 65])
+LABELVIE_DELIVERY = (['Date de livraison\nsouhaitee', 'Date de livraison limite'], [110, 110])
+LABELVIE_FIRST_TOP = 286
+LABELVIE_REST_TOP = 136
+LABELVIE_ROWS = (_capacity(LABELVIE_FIRST_TOP, 2), _capacity(LABELVIE_REST_TOP, 2) - 5)
+
+
+def labelvie(path, lines, orderer, eans, order_number, rng, unknown_ratio=0.05):
+    rows = order_lines(rng, eans, lines, unknown_ratio)
+    pages = _chunks(rows, *LABELVIE_ROWS)
+    canvas = Canvas()
+    line_number = 0
+    for number, page_rows in enumerate(pages, 1):
+        canvas.new_page()
+        canvas.table(28, 41, [539], [['BON DE COMMANDE\nLABEL VIE']])
+        if number == 1:
+            canvas.table(28, 136, LABELVIE_ORDER[1], [LABELVIE_ORDER[0],
+                                                       [order_number, '15/07/24 10:30', '579', '00579012', '1']])
+            canvas.table(28, 182, LABELVIE_ORDERER[1], [LABELVIE_ORDERER[0], [orderer, orderer, 'SOMATHES']])
+        table_rows = [LABELVIE_PRODUCTS[0]]
+        for ean, designation, quantity in page_rows:
+            line_number += 1
+            table_rows.append([str(100000 + line_number), ean, designation, 'Piece', '1', str(line_number), '1',
+                               str(quantity), '', ''])
+        bottom = canvas.table(28, LABELVIE_FIRST_TOP if number == 1 else LABELVIE_REST_TOP, LABELVIE_PRODUCTS[1],
+                              table_rows)
+        if number == len(pages):
+            canvas.table(28, bottom + 16, LABELVIE_DELIVERY[1], [LABELVIE_DELIVERY[0], ['20/07/24 08:00', '20/07/24 18:00']])
+    return canvas.save(path)
+
+
+GENERATORS = {
+    'marjane': marjane,
+    'vracmarjane': vracmarjane,
+    'labelvie': labelvie,
+}
+
+ROWS_PER_PAGE = {
+    'marjane': MARJANE_ROWS,
+    'vracmarjane': VRAC_ROWS,
+    'labelvie': LABELVIE_ROWS,
+}
+
+
+def lines_for_pages(retailer, pages):
+    # Line count filling the given number of pages of the retailer's layout
+    first, rest = ROWS_PER_PAGE[retailer]
+    return first + rest * (max(pages, 1) - 1)
+
+
+def generate(retailer, path, lines, dens, eans, seed=0, unknown_ratio=0.05):
+    # One synthetic order for the retailer, its store picked among the client Dens
+    rng = random.Random(seed)
+    den = rng.choice(dens) if dens else 'MARJANE CENTRE CASABLANCA'
+    order_number = str(2400000000 + rng.randint(0, 99999999))
+    if retailer == 'marjane':
+        # The portal prints the store name without the retailer prefix
+        den = den.replace('MARJANE ', '', 1).title()
+    return GENERATORS[retailer](path, lines, den, eans, order_number, rng, unknown_ratio)
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Per-PDF tabula latency: one Java subprocess per call (force_subprocess) against
+# tabula-py's in-process JVM, which needs jpype, and against one tabula-java call
+# for all the PDFs (tabula_jvm.read_pdfs, as batch runs use it). tabula keeps the
+# backend it picked in a module global (tabula.io._tabula_vm), so each mode is
+# measured in its own interpreter.
+#
+#   python benchmarks/tabula_latency.py Marjane/marjaneFull.pdf "Label Vie/LabelVie.pdf" --repeat 5
+
+MODES = {'subprocess per call': 'subprocess', 'in-process JVM': 'jvm', 'one call for all': 'batched'}
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def measure(pdfs, repeat, mode):
+    # Runs in the child interpreter: the first call (JVM startup included) and
+    # the following ones, in seconds per PDF
+    import tabula
+    from finalities import tabula_jvm
+
+    options = {'pages': 'all', 'multiple_tables': True}
+    if mode == 'batched':
+        first = timed(lambda: tabula_jvm.read_pdfs(pdfs, **options)) / len(pdfs)
+        times = [timed(lambda: tabula_jvm.read_pdfs(pdfs, **options)) / len(pdfs) for _ in range(repeat)]
+        return {'backend': tabula_jvm.backend(), 'first': first, 'times': times}
+    options['force_subprocess'] = mode == 'subprocess'
+    first = timed(lambda: tabula.read_pdf(pdfs[0], **options))
+    times = [timed(lambda: tabula.read_pdf(pdf, **options)) for _ in range(repeat) for pdf in pdfs]
+    backend = 'subprocess' if mode == 'subprocess' else tabula_jvm.backend()
+    return {'backend': backend, 'first': first, 'times': times}
+
+
+def run_mode(pdfs, repeat, mode):
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode,
+               '--repeat', str(repeat)] + pdfs
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare tabula extraction latency per PDF")
+    parser.add_argument('pdfs', nargs='+')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=sorted(MODES.values()), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(measure(args.pdfs, args.repeat, args.child)))
+        return
+
+    pdfs = [os.path.abspath(pdf) for pdf in args.pdfs]
+    print(f"{len(pdfs)} PDFs x {args.repeat} runs, each mode in a fresh interpreter")
+    for label, mode in MODES.items():
+        result = run_mode(pdfs, args.repeat, mode)
+        times = result['times']
+        print(f"{label:20} backend {result['backend']:10} first call {result['first']:.3f}s  "
+              f"mean {statistics.mean(times):.3f}s  median {statistics.median(times):.3f}s  max {max(times):.3f}s per PDF")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+# Shared helpers for the retailer purchase-order parsers (Marjane, Marjane vrac, LabelVie)
@@ -0,0 +1,3 @@
+from finalities.cli import main
+
+raise SystemExit(main())
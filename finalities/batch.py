@@ -0,0 +1,385 @@
+import argparse
+import csv
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import partial
+
+from finalities import metrics, tabula_jvm
+from finalities.bundle import DEFAULT_MAX_BYTES as DEFAULT_BUNDLE_BYTES, SageBundle
+from finalities.db import format_stats
+from finalities.extract_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ExtractCache, content_hash
+from finalities.fingerprint import route
+from finalities.journal import COMPLETED, DEFAULT_JOURNAL, Journal
+from finalities.parsers import PARSERS, get_parser
+from finalities.refcache import get_reference_cache
+
+# PDFs per extraction task in run_batch(): those of tabula parsers are read in
+# one tabula-java call (tabula_jvm.prefetch), saving a JVM start per PDF when
+# tabula runs as a subprocess
+TABULA_BATCH = 8
+
+
+def find_pdfs(inputs):
+    # Expand directories and glob patterns into a sorted list of PDF files
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.pdf')
+        paths.update(path for path in glob.glob(pattern) if path.lower().endswith('.pdf'))
+    return sorted(paths)
+
+
+def output_path(pdf_path, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(pdf_path))[0] + '.csv')
+
+
+def unique_path(path, taken):
+    # path, or path with -2, -3... before the extension: the first for which taken() is false
+    base, extension = os.path.splitext(path)
+    candidate, number = path, 1
+    while taken(candidate):
+        number += 1
+        candidate = f"{base}-{number}{extension}"
+    return candidate
+
+
+def output_paths(pdf_paths, output_dir):
+    # {PDF: Sage file} of one run. PDFs of the same name from different
+    # directories get -2, -3... in input order rather than overwriting each
+    # other's file and reject report; a rerun of the same inputs gets the same names.
+    outputs = {}
+    taken = set()
+    for pdf_path in pdf_paths:
+        output = unique_path(output_path(pdf_path, output_dir), taken.__contains__)
+        taken.add(output)
+        outputs[pdf_path] = output
+    return outputs
+
+
+def profile_path(profile_dir, pdf_path, stage, profiler='cprofile'):
+    # <profile_dir>/<order>.<stage>.prof (.html for pyinstrument), None without a profile directory
+    if not profile_dir:
+        return None
+    extension = 'html' if profiler == 'pyinstrument' else 'prof'
+    return os.path.join(profile_dir, f"{os.path.splitext(os.path.basename(pdf_path))[0]}.{stage}.{extension}")
+
+
+def extract_in_worker(retailer, pdf_path, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                      profile_dir=None, profiler='cprofile'):
+    # Runs in a worker process: PDF extraction only, no database access.
+    # Without a retailer the PDF is routed by its page-1 layout fingerprint first, so only
+    # the matching extractor runs. With a cache directory, a PDF whose content was
+    # already extracted is read back instead. Returns a dict with the retailer, the
+    # tables (None on failure), the PO number, the error traceback, seconds, cached
+    # and the metrics.
+    start = time.perf_counter()
+    result = {'retailer': retailer, 'tables': None, 'order_ref': None, 'error': None, 'cached': False}
+    with metrics.measure() as measured, metrics.profiled(profile_path(profile_dir, pdf_path, 'extract', profiler), profiler):
+        try:
+            result['retailer'] = retailer or route(pdf_path)
+            if cache_dir:
+                cache = ExtractCache(cache_dir, cache_max_bytes)
+                result['tables'] = cache.extract(result['retailer'], pdf_path)
+                result['cached'] = cache.hits > 0
+            else:
+                result['tables'] = get_parser(result['retailer']).extract_tables(pdf_path)
+            if result['tables']:
+                result['order_ref'] = get_parser(result['retailer']).order_reference(result['tables'])
+        except Exception:
+            result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    result['metrics'] = measured.as_dict()
+    return result
+
+
+def extract_chunk_in_worker(retailer, pdf_paths, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                            profile_dir=None, profiler='cprofile'):
+    # extract_in_worker() for several PDFs in one task, returning their results in
+    # order. The PDFs routed to a tabula parser (one with tabula_pass()) and not
+    # in the extraction cache are first read with one tabula call per parser;
+    # extract_tables() then gets their tables from tabula_jvm.read_pdf().
+    routes = {}
+    for pdf_path in pdf_paths:
+        try:
+            routes[pdf_path] = retailer or route(pdf_path)
+        except Exception:
+            routes[pdf_path] = None  # extract_in_worker() reports the error
+    cache = ExtractCache(cache_dir, cache_max_bytes) if cache_dir else None
+    groups = {}
+    for pdf_path, name in routes.items():
+        if name and hasattr(get_parser(name), 'tabula_pass') and not (cache and cache.contains(name, pdf_path)):
+            groups.setdefault(name, []).append(pdf_path)
+    try:
+        for name, paths in groups.items():
+            if len(paths) > 1:
+                tabula_jvm.prefetch(paths, **get_parser(name).tabula_pass())
+        return [extract_in_worker(routes[pdf_path], pdf_path, cache_dir, cache_max_bytes, profile_dir, profiler)
+                for pdf_path in pdf_paths]
+    finally:
+        tabula_jvm.discard_prefetched()
+
+
+def chunked(pdf_paths, retailer, workers, tabula_batch=TABULA_BATCH):
+    # Extraction tasks of run_batch(): PDFs in groups of up to tabula_batch, small
+    # enough to keep every worker busy, or one by one for a parser without tabula
+    size = 1
+    if tabula_batch > 1 and (retailer is None or hasattr(get_parser(retailer), 'tabula_pass')):
+        size = max(1, min(tabula_batch, -(-len(pdf_paths) // workers)))
+    return [pdf_paths[start:start + size] for start in range(0, len(pdf_paths), size)]
+
+
+def skipped_entry(pdf_path, previous, status='skipped'):
+    # Report entry of a PDF that was already converted, from the earlier conversion's journal row
+    return {'file': pdf_path, 'retailer': previous['retailer'], 'order_ref': previous['order_ref'], 'status': status,
+            'output': previous['output'], 'rejected': 0, 'cached': False, 'extract_seconds': 0.0, 'export_seconds': 0.0,
+            'error': f"already converted from {previous['file']}" if previous['file'] != pdf_path else ''}
+
+
+def check_journal(journal, pdf_path, file_hash=None):
+    # (content hash, report entry) of a PDF before extraction; the entry is None
+    # unless the journal shows a PDF with the same content was already converted
+    file_hash = file_hash or content_hash(pdf_path)
+    previous = journal.find_file(file_hash)
+    if previous is not None and previous['status'] in COMPLETED:
+        return file_hash, skipped_entry(pdf_path, previous)
+    return file_hash, None
+
+
+def export_extracted(result, pdf_path, output_dir, reference_cache, debug_dir=None, profile_dir=None, profiler='cprofile',
+                     journal=None, file_hash=None, bundle=None, output=None):
+    # Resolve and write one order from extract_in_worker()'s result, in this process.
+    # Logs the order's metrics (worker timers and counters included) as one JSON line
+    # and returns its batch report entry, with the full traceback of a failure.
+    # With a journal, an order whose PO number was already converted from another
+    # PDF is not exported again (status 'duplicate'), and the outcome is recorded
+    # under the PDF's content hash. With a SageBundle, the order is added to the
+    # bundle's current file instead of its own, and journaled by the bundle's
+    # on_flush once that file is written. output is the Sage file to write,
+    # output_path() by default.
+    entry = {'file': pdf_path, 'retailer': result['retailer'] or '', 'order_ref': result.get('order_ref') or '',
+             'status': 'failed', 'output': '', 'rejected': 0, 'cached': result['cached'],
+             'extract_seconds': round(result['seconds'], 3), 'export_seconds': 0.0, 'error': ''}
+    error = result['error']
+    previous = None
+    if journal is not None and error is None:
+        previous = journal.find_order(entry['retailer'], entry['order_ref'])
+        if previous is not None and previous['file_hash'] == file_hash:
+            previous = None
+        if previous is None and bundle is not None:
+            previous = bundle.pending_order(entry['retailer'], entry['order_ref'])
+    with metrics.order_metrics(file=pdf_path, retailer=entry['retailer'], cached=entry['cached']) as order:
+        order.merge(result['metrics'])
+        if previous is not None:
+            entry.update(status='duplicate', output=previous['output'],
+                         error=f"PO {entry['order_ref']} already converted from {previous['file']}")
+            order.fields.update(status='duplicate')
+        elif error is None:
+            export_start = time.perf_counter()
+            with metrics.profiled(profile_path(profile_dir, pdf_path, 'export', profiler), profiler):
+                try:
+                    if not result['tables']:
+                        raise ValueError("No tables found in the PDF.")
+                    output = output or output_path(pdf_path, output_dir)
+                    if bundle is not None:
+                        target = bundle.order(os.path.basename(output), file=pdf_path, file_hash=file_hash,
+                                              retailer=entry['retailer'], order_ref=entry['order_ref'])
+                    else:
+                        target = nullcontext(output)
+                    with target as output:
+                        written = get_parser(result['retailer']).export_order(
+                            result['tables'], output, reference_cache, debug_dir)
+                        if written is None:
+                            raise ValueError("One or more required tables are missing.")
+                    entry.update(status='ok', output=output.path if bundle is not None else written)
+                except Exception:
+                    error = traceback.format_exc()
+            entry['export_seconds'] = round(time.perf_counter() - export_start, 3)
+            entry['rejected'] = order.counters.get('lines_rejected', 0)
+        if error is not None:
+            entry['error'] = error.strip().splitlines()[-1]
+            entry['traceback'] = error
+            order.fields.update(status='failed', error=entry['error'])
+        order.fields.update(output=entry['output'], order_ref=entry['order_ref'], extract_seconds=entry['extract_seconds'])
+    if journal is not None and file_hash and not (bundle is not None and entry['status'] == 'ok'):
+        journal.record(file_hash, pdf_path, entry['status'], entry['retailer'], entry['order_ref'],
+                       entry['output'], entry['error'])
+    return entry
+
+
+def journal_prepass(journal, pdf_paths, retailer):
+    # Split pdf_paths before extraction: (report entries of the PDFs to skip, PDFs
+    # to convert, content hash of each). Without a journal every PDF is converted.
+    if journal is None:
+        return [], list(pdf_paths), {}
+    skipped, pending, hashes, first_seen = [], [], {}, {}
+    for pdf_path in pdf_paths:
+        file_hash, entry = check_journal(journal, pdf_path)
+        if entry is None and file_hash in first_seen:
+            entry = skipped_entry(pdf_path, {'retailer': retailer or '', 'order_ref': '', 'output': '',
+                                             'file': first_seen[file_hash]}, 'duplicate')
+            entry['error'] = f"same PDF as {first_seen[file_hash]}"
+        if entry is not None:
+            skipped.append(entry)
+            continue
+        first_seen[file_hash] = pdf_path
+        hashes[pdf_path] = file_hash
+        pending.append(pdf_path)
+    return skipped, pending, hashes
+
+
+def record_bundled(journal, path, orders):
+    # SageBundle on_flush: journal the orders of a packed file once it is written
+    for info in orders:
+        if journal is not None and info['file_hash']:
+            journal.record(info['file_hash'], info['file'], 'ok', info['retailer'], info['order_ref'], path)
+
+
+def summarize(report, workers, bundle, elapsed, db_pool=None):
+    # db_pool: ConnectionPool.stats() of the run's reference cache
+    return {
+        'files': len(report),
+        'succeeded': sum(entry['status'] == 'ok' for entry in report),
+        'failed': sum(entry['status'] == 'failed' for entry in report),
+        'skipped': sum(entry['status'] in ('skipped', 'duplicate') for entry in report),
+        'cached': sum(entry['cached'] for entry in report),
+        'workers': workers,
+        'manifest': bundle.manifest_path if bundle is not None and bundle.files else '',
+        'seconds': round(elapsed, 3),
+        'orders_per_second': round(len(report) / elapsed, 2) if elapsed else 0.0,
+        'db_pool': db_pool or {},
+    }
+
+
+def run_batch(pdf_paths, retailer, output_dir, workers=None, reference_cache=None, debug_dir=None,
+              cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES, profile_dir=None, profiler='cprofile',
+              journal=None, bundle_orders=None, bundle_max_bytes=DEFAULT_BUNDLE_BYTES, tabula_batch=TABULA_BATCH):
+    # Extract every PDF in a process pool sized to the cores, then resolve and write
+    # each order in this process as its tables arrive, against one warm reference cache.
+    # retailer None routes each PDF to its parser by layout fingerprint. With a
+    # journal, PDFs already converted by an earlier run (or appearing twice in this
+    # one) are skipped before extraction, so a run that died can simply be restarted.
+    # With bundle_orders, orders are packed into consolidated Sage files of at most
+    # that many orders (and bundle_max_bytes) listed in a manifest, see SageBundle.
+    # Each worker task takes up to tabula_batch PDFs, read in one tabula call
+    # (extract_chunk_in_worker); 1 reads every PDF on its own.
+    if retailer:
+        get_parser(retailer)
+    reference_cache = reference_cache or get_reference_cache()
+    os.makedirs(output_dir, exist_ok=True)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    report = []
+    start = time.perf_counter()
+
+    skipped, pdf_paths, hashes = journal_prepass(journal, pdf_paths, retailer)
+    report.extend(skipped)
+    outputs = output_paths(pdf_paths, output_dir)
+    bundle = None
+    if bundle_orders:
+        bundle = SageBundle(output_dir, max_orders=bundle_orders, max_bytes=bundle_max_bytes,
+                            on_flush=partial(record_bundled, journal))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, bundle or nullcontext():
+        futures = {pool.submit(extract_chunk_in_worker, retailer, chunk, cache_dir, cache_max_bytes, profile_dir, profiler): chunk
+                   for chunk in chunked(pdf_paths, retailer, workers, tabula_batch)}
+
+        # Warm the cache while the workers extract
+        reference_cache.products()
+        reference_cache.client_index()
+
+        for future in as_completed(futures):
+            for pdf_path, result in zip(futures[future], future.result()):
+                report.append(export_extracted(result, pdf_path, output_dir, reference_cache, debug_dir,
+                                               profile_dir, profiler, journal, hashes.get(pdf_path), bundle,
+                                               outputs[pdf_path]))
+
+    return report, summarize(report, workers, bundle, time.perf_counter() - start, reference_cache.pool_stats())
+
+
+def write_report(report, path):
+    fields = ['file', 'retailer', 'order_ref', 'status', 'output', 'rejected', 'cached', 'extract_seconds', 'export_seconds', 'error']
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields, delimiter=';', extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(report)
+
+
+def main(argv=None):
+    from finalities.pipeline import QUEUE_SIZE, run_pipeline
+
+    parser = argparse.ArgumentParser(description="Convert a batch of purchase-order PDFs into Sage ERP files")
+    parser.add_argument('inputs', nargs='+', help="PDF directories or glob patterns")
+    parser.add_argument('--retailer', default=None, choices=sorted(PARSERS),
+                        help="Parser to use for every PDF (default: detect each PDF's layout)")
+    parser.add_argument('--output-dir', required=True, help="Directory receiving one Sage file per order")
+    parser.add_argument('--workers', type=int, default=None, help="Extraction processes (default: number of cores)")
+    parser.add_argument('--debug-dir', default=None, help="Also write every classified table as CSV here")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="Extraction cache directory")
+    parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help="Extraction cache size limit")
+    parser.add_argument('--no-cache', action='store_true', help="Always extract, ignoring the extraction cache")
+    parser.add_argument('--bundle', type=int, default=None, metavar='ORDERS',
+                        help="Pack up to this many orders per Sage file, listed in a manifest, instead of one file per order")
+    parser.add_argument('--bundle-max-mb', type=int, default=DEFAULT_BUNDLE_BYTES // (1024 * 1024),
+                        help="Size limit of one packed Sage file")
+    parser.add_argument('--tabula-batch', type=int, default=TABULA_BATCH, metavar='PDFS',
+                        help="PDFs of tabula layouts (Marjane, LabelVie) read in one tabula call; 1 reads each on its own")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Overlap extraction, resolution and writing in bounded queues and report each stage's utilization")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="Orders waiting between two stages of --pipeline")
+    parser.add_argument('--resolve-threads', type=int, default=1, help="Threads resolving orders in --pipeline mode")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL,
+                        help="Journal of converted orders, used to skip them when a run is restarted")
+    parser.add_argument('--no-journal', action='store_true', help="Convert every PDF, without reading or updating the journal")
+    parser.add_argument('--metrics-log', default=None, help="Append one JSON line of metrics per order to this file")
+    parser.add_argument('--profile-dir', default=None, help="Write a profile of each order's extraction and export here")
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'pyinstrument'])
+    parser.add_argument('--verbose', action='store_true', help="Log the parsers' debug messages")
+    args = parser.parse_args(argv)
+    metrics.setup_logging(args.metrics_log, args.verbose)
+
+    pdf_paths = find_pdfs(args.inputs)
+    if not pdf_paths:
+        print("No PDF files found.")
+        return 1
+
+    journal = None if args.no_journal else Journal(args.journal)
+    try:
+        options = dict(debug_dir=args.debug_dir, cache_dir=None if args.no_cache else args.cache_dir,
+                       cache_max_bytes=args.cache_max_mb * 1024 * 1024, profile_dir=args.profile_dir,
+                       profiler=args.profiler, journal=journal, bundle_orders=args.bundle,
+                       bundle_max_bytes=args.bundle_max_mb * 1024 * 1024)
+        if args.pipeline:
+            report, summary = run_pipeline(pdf_paths, args.retailer, args.output_dir, args.workers,
+                                           queue_size=args.queue_size, resolve_threads=args.resolve_threads, **options)
+        else:
+            report, summary = run_batch(pdf_paths, args.retailer, args.output_dir, args.workers,
+                                        tabula_batch=args.tabula_batch, **options)
+    finally:
+        if journal is not None:
+            journal.close()
+    for entry in sorted(report, key=lambda entry: entry['file']):
+        detail = entry['output'] if entry['status'] == 'ok' else entry['error'] or entry['output']
+        print(f"{entry['status']:9} {entry['file']} -> {detail}")
+    report_path = os.path.join(args.output_dir, 'batch_report.csv')
+    write_report(report, report_path)
+    print(f"{summary['succeeded']}/{summary['files']} orders converted ({summary['cached']} from cache, "
+          f"{summary['skipped']} already done) in {summary['seconds']}s "
+          f"({summary['orders_per_second']} orders/s, {summary['workers']} workers), report at {report_path}")
+    for name, stage in summary.get('stages', {}).items():
+        print(f"{name:8} {stage['utilization']:6.0%} busy over {stage['lanes']} lane(s): {stage['busy_seconds']}s working, "
+              f"{stage['starved_seconds']}s waiting for input, {stage['blocked_seconds']}s held back, "
+              f"queue peak {stage['peak_queue']}")
+    if summary['db_pool']:
+        print(format_stats(summary['db_pool']))
+    if summary['manifest']:
+        print(f"Sage files listed in {summary['manifest']}")
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
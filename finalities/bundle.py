@@ -0,0 +1,178 @@
+import hashlib
+import io
+import json
+import os
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import pandas as pd
+
+from finalities import metrics
+from finalities.normalize import rejects_path
+from finalities.sage import E_FIELDS, atomic_open
+
+# Limits of one consolidated import file; whichever is reached first closes it
+DEFAULT_MAX_ORDERS = 500
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class BundleOrder:
+    # Output target handed to a parser's export_order() in place of a path: the
+    # order's records are collected in memory and join the bundle only once the
+    # export succeeded, so a failing order never leaves half an order in a file.
+    # str() is the order's name, used for debug tables and log messages.
+
+    def __init__(self, name):
+        self.name = name
+        self.buffer = io.StringIO()
+        self.rejects = []
+        self.path = None
+
+    def open(self):
+        return nullcontext(self.buffer)
+
+    def add_rejects(self, rejects):
+        if not rejects.empty:
+            self.rejects.append(rejects)
+
+    def __str__(self):
+        return self.name
+
+
+class SageBundle:
+    # Packs the E/L blocks of many orders into a few Sage X3 import files of at
+    # most max_orders orders and max_bytes bytes each, so the ERP runs one import
+    # per file rather than one per order:
+    #   <output_dir>/<prefix>_0001.csv, <prefix>_0002.csv, ...
+    #   <output_dir>/<prefix>.manifest.json
+    # Orders are buffered in memory and each file is written in one go through a
+    # temporary file renamed into place; the lines the parsers rejected go to a
+    # <prefix>_0001.rejects.csv next to it. The manifest lists every written file
+    # with its orders, line count, size, sha256 and rejected lines; it is replaced
+    # atomically after each file and marked complete by close(). on_flush(path,
+    # orders) is called once a file is on disk, with the info given to order() for
+    # each of its orders.
+
+    def __init__(self, output_dir, prefix=None, max_orders=DEFAULT_MAX_ORDERS, max_bytes=DEFAULT_MAX_BYTES,
+                 on_flush=None):
+        self.output_dir = output_dir
+        self.prefix = prefix or self.new_prefix(output_dir)
+        self.max_orders = max_orders
+        self.max_bytes = max_bytes
+        self.on_flush = on_flush
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.files = []
+        self.parts = []
+        self.pending = []
+        self.rejects = []
+        self.size = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        # Orders exported before an error are still written, but the manifest
+        # is only marked complete when the run finished
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
+
+    @staticmethod
+    def new_prefix(output_dir):
+        # sage_erp_<date>_<time>, numbered when a run of the same second left files
+        prefix = base = datetime.now().strftime('sage_erp_%Y%m%d_%H%M%S')
+        number = 1
+        while os.path.exists(os.path.join(output_dir, prefix + '.manifest.json')):
+            number += 1
+            prefix = f"{base}_{number}"
+        return prefix
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.output_dir, self.prefix + '.manifest.json')
+
+    def current_path(self):
+        # File the orders added now will be written to
+        return os.path.join(self.output_dir, f"{self.prefix}_{len(self.files) + 1:04d}.csv")
+
+    @contextmanager
+    def order(self, name, **info):
+        # Target for one order's export; the order is added when the block succeeds
+        target = BundleOrder(name)
+        yield target
+        self.add(target, **info)
+
+    def add(self, target, **info):
+        text = target.buffer.getvalue()
+        if not text:
+            return
+        size = len(text.encode())
+        if self.pending and self.size + size > self.max_bytes:
+            self.flush()
+        header = dict(zip(E_FIELDS, text.split('\n', 1)[0].split(';')))
+        target.path = self.current_path()
+        self.parts.append(text)
+        self.rejects.extend(target.rejects)
+        self.pending.append(dict(info, name=target.name, output=target.path, CUSORDREF=header.get('CUSORDREF', ''),
+                                 BPCORD=header.get('BPCORD', ''), lines=text.count('\n') - 1))
+        self.size += size
+        if len(self.pending) >= self.max_orders or self.size >= self.max_bytes:
+            self.flush()
+
+    def pending_order(self, retailer, order_ref):
+        # Info of an order with this PO number waiting to be written (with the output
+        # path it will have), None if there is none
+        for info in self.pending:
+            if order_ref and info.get('retailer') == retailer and info.get('order_ref') == order_ref:
+                return info
+        return None
+
+    def flush(self):
+        # Write the pending orders as the next file; returns its path, None when empty
+        if not self.pending:
+            return None
+        path = self.current_path()
+        data = ''.join(self.parts)
+        with metrics.timer('csv_write'), atomic_open(path) as file:
+            file.write(data)
+            encoded = data.encode(file.encoding)
+        flushed = self.pending
+        rejected = sum(len(rejects) for rejects in self.rejects)
+        if rejected:
+            with atomic_open(rejects_path(path)) as file:
+                pd.concat(self.rejects, ignore_index=True).to_csv(file, sep=';', index=False, lineterminator='\n')
+        self.files.append({
+            'file': os.path.basename(path),
+            'orders': len(flushed),
+            'lines': sum(info['lines'] for info in flushed),
+            'bytes': len(encoded),
+            'sha256': hashlib.sha256(encoded).hexdigest(),
+            'rejected_lines': rejected,
+            'rejects': os.path.basename(rejects_path(path)) if rejected else '',
+            'contents': [{'name': info['name'], 'source': info.get('file', ''), 'retailer': info.get('retailer', ''),
+                          'CUSORDREF': info['CUSORDREF'], 'BPCORD': info['BPCORD'], 'lines': info['lines']}
+                         for info in flushed],
+        })
+        self.parts = []
+        self.pending = []
+        self.rejects = []
+        self.size = 0
+        self.write_manifest()
+        if self.on_flush:
+            self.on_flush(path, flushed)
+        return path
+
+    def write_manifest(self, complete=False):
+        manifest = {'prefix': self.prefix, 'created': self.created, 'complete': complete,
+                    'orders': sum(entry['orders'] for entry in self.files), 'files': self.files}
+        with atomic_open(self.manifest_path) as file:
+            json.dump(manifest, file, indent=2, default=str)
+
+    def close(self):
+        # Write the last file and mark the manifest complete; nothing is left
+        # behind when no order was added
+        self.flush()
+        if self.files:
+            self.write_manifest(complete=True)
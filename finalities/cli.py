@@ -0,0 +1,35 @@
+import importlib
+import sys
+
+# Sub-command -> (module whose main(argv) runs it, description). A module is only
+# imported when its command runs, so `python -m finalities memo review` or
+# `python -m finalities route` never load pandas, tabula or the database driver.
+COMMANDS = {
+    'convert': ('finalities.convert', "Convert one purchase-order PDF into a Sage ERP file"),
+    'batch': ('finalities.batch', "Convert a batch of purchase-order PDFs"),
+    'watch': ('finalities.daemon', "Watch an inbox directory and convert incoming purchase orders"),
+    'route': ('finalities.fingerprint', "Detect the retailer layout of purchase-order PDFs"),
+    'memo': ('finalities.matchmemo', "Review the memoized store matches and manage store aliases"),
+    'snapshot': ('finalities.snapshot', "Export the reference tables to a memory-mapped snapshot"),
+}
+
+
+def usage():
+    lines = ["usage: finalities <command> [options]", "", "commands:"]
+    lines += [f"  {command:10} {description}" for command, (_, description) in COMMANDS.items()]
+    lines += ["", "Run 'finalities <command> --help' for the options of a command."]
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    command, arguments = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"finalities: unknown command '{command}'\n\n{usage()}", file=sys.stderr)
+        return 2
+    # argparse names the program after argv[0] in usage and error messages
+    sys.argv = [f"finalities {command}"] + arguments
+    return importlib.import_module(COMMANDS[command][0]).main(arguments)
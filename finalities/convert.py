@@ -0,0 +1,57 @@
+import argparse
+import logging
+import os
+
+from finalities import metrics
+from finalities.fingerprint import route
+from finalities.parsers import PARSERS, get_parser
+
+logger = logging.getLogger(__name__)
+
+
+def convert(pdf_path, output_file, retailer=None, reference_cache=None, debug_dir=None, page_workers=1, stream=False):
+    # Convert one PDF with its retailer's parser (detected from page 1 when not
+    # given) and return the Sage file path; page_workers and stream only apply to
+    # vrac orders. The order's metrics are logged as one JSON line.
+    retailer = retailer or route(pdf_path)
+    parser = get_parser(retailer)
+    with metrics.order_metrics(retailer=retailer, file=pdf_path):
+        if stream and hasattr(parser, 'stream_order'):
+            written = parser.stream_order(pdf_path, output_file, reference_cache)
+        elif page_workers > 1 and retailer == 'vracmarjane':
+            written = parser.process_order(pdf_path, output_file, reference_cache, debug_dir, page_workers)
+        else:
+            written = parser.process_order(pdf_path, output_file, reference_cache, debug_dir)
+        if written is None:
+            raise ValueError("One or more required tables are missing.")
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert one purchase-order PDF into a Sage ERP file")
+    parser.add_argument('pdf')
+    parser.add_argument('--retailer', default=None, choices=sorted(PARSERS),
+                        help="Parser to use (default: detect the PDF's layout)")
+    parser.add_argument('--output', default=None, help="Sage file to write (default: <pdf name>.csv here)")
+    parser.add_argument('--debug-dir', default=None, help="Also write every classified table as CSV here")
+    parser.add_argument('--page-workers', type=int, default=1, help="Processes sharing the pages of a long vrac order")
+    parser.add_argument('--stream', action='store_true', help="Convert a long vrac order page by page with bounded memory")
+    parser.add_argument('--metrics-log', default=None, help="Append the order's metrics as a JSON line to this file")
+    parser.add_argument('--verbose', action='store_true', help="Log the parsers' debug messages")
+    args = parser.parse_args(argv)
+    metrics.setup_logging(args.metrics_log, args.verbose)
+
+    output_file = args.output or os.path.splitext(os.path.basename(args.pdf))[0] + '.csv'
+    try:
+        written = convert(args.pdf, output_file, args.retailer, debug_dir=args.debug_dir,
+                          page_workers=args.page_workers, stream=args.stream)
+    except Exception as error:
+        logger.debug("Conversion failed", exc_info=True)
+        print(f"failed {args.pdf}: {type(error).__name__}: {error}")
+        return 1
+    print(f"ok     {args.pdf} -> {written}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
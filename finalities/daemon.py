@@ -0,0 +1,230 @@
+import argparse
+import os
+import queue
+import shutil
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from finalities import metrics
+from finalities.batch import check_journal, export_extracted, extract_in_worker, output_path, unique_path
+from finalities.db import format_stats
+from finalities.extract_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from finalities.journal import DEFAULT_JOURNAL, Journal
+from finalities.normalize import rejects_path
+from finalities.parsers import PARSERS
+from finalities.refcache import get_reference_cache
+
+# Seconds between two scans of the inbox
+POLL_INTERVAL = 2.0
+# A file must keep the same size and mtime for this long before it is picked up
+SETTLE_SECONDS = 1.0
+# PDFs waiting for a worker; the scanner blocks when the queue is full
+QUEUE_SIZE = 32
+
+
+class HotFolder:
+    # Long-running ingestion service. PDFs dropped in <inbox>/<retailer>/, or in
+    # <inbox>/ itself to have their layout detected from page 1, are queued in a bounded queue (the scanner waits when it is full, so a flood
+    # of files never piles up in memory), extracted in a process pool whose
+    # workers keep their JVM warm, exported against the shared reference cache
+    # and connection pool, then moved to <inbox>/done/ or <inbox>/failed/. With a
+    # journal, a PDF or PO number that was already converted goes straight to done/.
+
+    def __init__(self, inbox, output_dir, workers=None, queue_size=QUEUE_SIZE, poll_interval=POLL_INTERVAL,
+                 settle_seconds=SETTLE_SECONDS, cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES,
+                 reference_cache=None, journal=None):
+        self.inbox = inbox
+        self.output_dir = output_dir
+        self.done_dir = os.path.join(inbox, 'done')
+        self.failed_dir = os.path.join(inbox, 'failed')
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.reference_cache = reference_cache or get_reference_cache()
+        self.journal = journal
+        self.stopping = threading.Event()
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+        self.claimed = {}  # PDF being converted -> its Sage file, under in_flight_lock
+        self.seen = {}  # path -> (size, mtime, first seen with that size and mtime)
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        for directory in [output_dir, self.done_dir, self.failed_dir] + [os.path.join(inbox, name) for name in PARSERS]:
+            os.makedirs(directory, exist_ok=True)
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def _settled(self, path, now):
+        # True once the file stopped changing, i.e. the sender finished writing it
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.seen.pop(path, None)
+            return False
+        signature = (stat.st_size, stat.st_mtime)
+        previous = self.seen.get(path)
+        if previous is None or previous[:2] != signature:
+            self.seen[path] = signature + (now,)
+            return False
+        return now - previous[2] >= self.settle_seconds
+
+    def scan(self):
+        # Queue every settled PDF not already queued or being processed
+        now = time.monotonic()
+        for retailer in [None] + list(PARSERS):
+            directory = os.path.join(self.inbox, retailer) if retailer else self.inbox
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not name.lower().endswith('.pdf'):
+                    continue
+                with self.in_flight_lock:
+                    if path in self.in_flight:
+                        continue
+                if not self._settled(path, now):
+                    continue
+                with self.in_flight_lock:
+                    self.in_flight.add(path)
+                self.seen.pop(path, None)
+                # Backpressure: wait for room in the queue rather than reading ahead
+                while not self.stopping.is_set():
+                    try:
+                        self.queue.put((retailer, path), timeout=self.poll_interval)
+                        break
+                    except queue.Full:
+                        continue
+
+    def _taken(self, output):
+        return (output in self.claimed.values() or os.path.exists(output)
+                or os.path.exists(rejects_path(output)))
+
+    def _claim_output(self, path):
+        # Sage file of a PDF: its name, or with -2, -3... when an earlier order or
+        # one in progress (a PDF of the same name in another retailer directory,
+        # or dropped again later) already has it
+        with self.in_flight_lock:
+            output = unique_path(output_path(path, self.output_dir), self._taken)
+            self.claimed[path] = output
+        return output
+
+    def _finish(self, path, target_dir, error=None):
+        with self.in_flight_lock:
+            target = unique_path(os.path.join(target_dir, os.path.basename(path)),
+                                 lambda candidate: os.path.exists(candidate) or os.path.exists(candidate + '.error.txt'))
+            shutil.move(path, target)
+            self.claimed.pop(path, None)
+            self.in_flight.discard(path)
+        if error:
+            with open(target + '.error.txt', 'w') as file:
+                file.write(error)
+
+    def _count(self, counter):
+        with self.in_flight_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def handle(self, pool, retailer, path):
+        start = time.perf_counter()
+        try:
+            file_hash, entry = check_journal(self.journal, path) if self.journal is not None else (None, None)
+            if entry is None:
+                result = pool.submit(extract_in_worker, retailer, path, self.cache_dir, self.cache_max_bytes).result()
+                entry = export_extracted(result, path, self.output_dir, self.reference_cache,
+                                         journal=self.journal, file_hash=file_hash, output=self._claim_output(path))
+            if entry['status'] == 'ok':
+                self._finish(path, self.done_dir)
+                self._count('processed')
+                print(f"done   {path} -> {entry['output']} in {time.perf_counter() - start:.2f}s{' (cached)' if entry['cached'] else ''}")
+            elif entry['status'] in ('skipped', 'duplicate'):
+                self._finish(path, self.done_dir)
+                self._count('skipped')
+                print(f"skip   {path}: {entry['error'] or 'already converted'} -> {entry['output']}")
+            else:
+                self._finish(path, self.failed_dir, entry['traceback'])
+                self._count('failed')
+                print(f"failed {path}: {entry['error']}")
+        except Exception:
+            # A broken worker pool, the journal or a move failing: the PDF still
+            # goes to failed/, releasing its in-flight entry and output name. When
+            # even that move fails, it stays in the inbox, left alone until restart.
+            error = traceback.format_exc()
+            self._count('failed')
+            print(f"failed {path}: {error.strip().splitlines()[-1]}")
+            try:
+                self._finish(path, self.failed_dir, error)
+            except Exception:
+                traceback.print_exc()
+                with self.in_flight_lock:
+                    self.claimed.pop(path, None)
+
+    def _dispatch(self, pool):
+        while not self.stopping.is_set() or not self.queue.empty():
+            try:
+                retailer, path = self.queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            try:
+                self.handle(pool, retailer, path)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def run(self):
+        # Warm the reference cache before the first order arrives
+        self.reference_cache.products()
+        self.reference_cache.client_index()
+        print(f"Watching {self.inbox} with {self.workers} workers")
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            dispatchers = [threading.Thread(target=self._dispatch, args=(pool,), daemon=True)
+                           for _ in range(self.workers)]
+            for dispatcher in dispatchers:
+                dispatcher.start()
+            while not self.stopping.is_set():
+                self.scan()
+                self.stopping.wait(self.poll_interval)
+            for dispatcher in dispatchers:
+                dispatcher.join()
+        print(f"Stopped: {self.processed} orders done, {self.skipped} already done, {self.failed} failed; "
+              f"{format_stats(self.reference_cache.pool_stats())}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch an inbox directory and convert incoming purchase orders")
+    parser.add_argument('inbox', help="Directory receiving PDFs, directly (layout detected) or in one "
+                                      "sub-directory per retailer: " + ', '.join(PARSERS))
+    parser.add_argument('--output-dir', required=True, help="Directory receiving one Sage file per order")
+    parser.add_argument('--workers', type=int, default=None, help="Extraction processes (default: number of cores)")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="Extraction cache directory")
+    parser.add_argument('--no-cache', action='store_true', help="Always extract, ignoring the extraction cache")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL, help="Journal of converted orders, to skip repeated ones")
+    parser.add_argument('--no-journal', action='store_true', help="Convert every PDF, without reading or updating the journal")
+    parser.add_argument('--metrics-log', default=None, help="Append one JSON line of metrics per order to this file")
+    parser.add_argument('--verbose', action='store_true', help="Log the parsers' debug messages")
+    args = parser.parse_args(argv)
+    metrics.setup_logging(args.metrics_log, args.verbose)
+
+    service = HotFolder(args.inbox, args.output_dir, workers=args.workers, queue_size=args.queue_size,
+                        poll_interval=args.poll_interval, cache_dir=None if args.no_cache else args.cache_dir,
+                        journal=None if args.no_journal else Journal(args.journal))
+    signal.signal(signal.SIGINT, service.stop)
+    signal.signal(signal.SIGTERM, service.stop)
+    try:
+        service.run()
+    finally:
+        if service.journal is not None:
+            service.journal.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+# Database connection settings; rows are returned as dicts (pymysql DictCursor)
+db_config = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '',
+    'db': 'SomathesProducts',
+    'charset': 'utf8mb4',
+}
+
+# Pool limits
+POOL_MAX_SIZE = 4        # connections open at the same time
+POOL_TIMEOUT = 30        # seconds to wait for a free connection before giving up
+POOL_PROBE_AFTER = 60    # seconds idle after which a connection is pinged before reuse
+POOL_MAX_IDLE = 600      # seconds idle after which a connection is closed instead of reused
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def open_connection():
+    # New pymysql connection; pymysql is only imported once a connection is needed
+    import pymysql
+    import pymysql.cursors
+
+    return pymysql.connect(cursorclass=pymysql.cursors.DictCursor, **db_config)
+
+
+def ping(connection):
+    # Health probe for pymysql connections, raises if the server went away
+    connection.ping(reconnect=False)
+
+
+class ConnectionPool:
+    # Bounded pool of database connections shared by every order and thread.
+    # A connection idle for more than probe_after seconds is health-checked
+    # before it is handed out; one idle for more than max_idle is replaced.
+    # Each transaction is ended when the connection comes back, so cached
+    # connections never keep serving an old snapshot.
+
+    def __init__(self, connect=None, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 probe_after=POOL_PROBE_AFTER, max_idle=POOL_MAX_IDLE, probe=ping, clock=time.monotonic):
+        self.connect = connect or open_connection
+        self.max_size = max_size
+        self.timeout = timeout
+        self.probe_after = probe_after
+        self.max_idle = max_idle
+        self.probe = probe
+        self.clock = clock
+        self.idle = collections.deque()  # (connection, released_at), most recent last
+        self.size = 0
+        self.condition = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.discarded = 0
+
+    def _discard(self, connection):
+        self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _take_idle(self):
+        # Pop the most recently used idle connection that is still healthy, or None
+        while self.idle:
+            connection, released_at = self.idle.pop()
+            idle_for = self.clock() - released_at
+            if idle_for > self.max_idle:
+                self.size -= 1
+                self._discard(connection)
+                continue
+            if idle_for > self.probe_after:
+                try:
+                    self.probe(connection)
+                except Exception:
+                    self.size -= 1
+                    self._discard(connection)
+                    continue
+            return connection
+        return None
+
+    def acquire(self):
+        start = self.clock()
+        with self.condition:
+            waited = False
+            while True:
+                connection = self._take_idle()
+                if connection is not None:
+                    self.hits += 1
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    self.misses += 1
+                    break
+                remaining = self.timeout - (self.clock() - start)
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s "
+                                      f"({self.max_size} in use)")
+                waited = True
+                self.condition.wait(remaining)
+            if waited:
+                elapsed = self.clock() - start
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify()
+                raise
+        return connection
+
+    def release(self, connection, broken=False):
+        if not broken:
+            try:
+                connection.rollback()
+            except Exception:
+                broken = True
+        with self.condition:
+            if broken:
+                self.size -= 1
+                self._discard(connection)
+            else:
+                self.idle.append((connection, self.clock()))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except Exception:
+            self.release(connection, broken=True)
+            raise
+        else:
+            self.release(connection)
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as connection:
+            with connection.cursor() as cursor:
+                yield cursor
+
+    def close(self):
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.pop()
+                self.size -= 1
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'size': self.size,
+            'idle': len(self.idle),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+            'waits': self.waits,
+            'wait_time': round(self.wait_time, 6),
+            'max_wait': round(self.max_wait, 6),
+            'discarded': self.discarded,
+        }
+
+
+def format_stats(stats):
+    # One-line summary of ConnectionPool.stats() for run and shutdown messages
+    return (f"database pool: {stats['size']} connection(s), {stats['hits'] + stats['misses']} checkouts "
+            f"({stats['hit_ratio']:.0%} reused), {stats['waits']} waits (max {stats['max_wait']:.3f}s), "
+            f"{stats['discarded']} discarded")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(**limits):
+    # Process-wide pool; limits only apply when the pool is first created
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(**limits)
+        return _pool
+
@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import pandas as pd
+
+from finalities.parsers import get_parser
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'finalities', 'tables')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Bytes read at a time while hashing a PDF
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def content_hash(pdf_path):
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractCache:
+    # On-disk cache of classified tables keyed by the PDF content hash, the
+    # retailer and its parser's EXTRACTOR_VERSION, so a resent or retried
+    # purchase order skips extraction entirely. Each entry is the dict of
+    # DataFrames pickled with gzip (pandas stores them column-block by
+    # column-block). The directory is kept under max_bytes by evicting the least
+    # recently used entries; a hit refreshes the entry's mtime.
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, retailer, pdf_path):
+        version = getattr(get_parser(retailer), 'EXTRACTOR_VERSION', 0)
+        return f"{retailer}-v{version}-{content_hash(pdf_path)}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl.gz')
+
+    def contains(self, retailer, pdf_path):
+        return os.path.exists(self._path(self.key(retailer, pdf_path)))
+
+    def get(self, key):
+        # The cached tables, None on a miss. An entry that cannot be loaded
+        # (truncated, corrupt, or pickled by a pandas whose classes no longer
+        # import) is deleted and counts as a miss, so the PDF is extracted again.
+        path = self._path(key)
+        try:
+            tables = pd.read_pickle(path, compression='gzip')
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Dropping unreadable extraction cache entry %s", path, exc_info=True)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted meanwhile; the tables were read
+        return tables
+
+    def put(self, key, tables):
+        # Write through a temporary file so readers never see a partial entry
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(handle)
+        try:
+            pd.to_pickle(tables, temp_path, compression='gzip')
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits in max_bytes
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.pkl.gz'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def extract(self, retailer, pdf_path):
+        # Cached tables for the PDF, extracting and storing them on a miss
+        key = self.key(retailer, pdf_path)
+        tables = self.get(key)
+        if tables is not None:
+            self.hits += 1
+            return tables
+        self.misses += 1
+        tables = get_parser(retailer).extract_tables(pdf_path)
+        if tables:
+            self.put(key, tables)
+        return tables
@@ -0,0 +1,123 @@
+import argparse
+import re
+import unicodedata
+
+from finalities import metrics
+from finalities.parsers import PARSERS
+
+# Share of the first page, from the top, holding the title and header tables
+HEADER_REGION = 0.45
+
+# Below this confidence a PDF is reported as unknown instead of being routed
+MIN_CONFIDENCE = 0.6
+
+# Layout -> (pattern, weight) features looked up in the compacted page-1 header
+# text (lowercase, accents and whitespace removed, since pdfplumber glues or
+# splits words differently from one layout to the other). Negative weights
+# count against a layout when the pattern shows up.
+LAYOUTS = {
+    'marjane': [
+        (r'portailmarjane', 3),
+        (r'datelivraisonprevue', 2),
+        (r'codesite', 1),
+        (r'qtecmdua', 1),
+        (r'g\.o\.l\.d\.report', -3),
+    ],
+    'vracmarjane': [
+        (r'nocommande', 2),
+        (r'commandepar', 2),
+        (r'contratcommercial', 1),
+        (r'marjane', 2),
+        (r'quanten', 1),
+        (r'g\.o\.l\.d\.report', -3),
+        (r'portailmarjane', -3),
+    ],
+    'labelvie': [
+        (r'g\.o\.l\.d\.report', 1),
+        (r"label'?vie", 3),
+        (r'codeean', 2),
+        (r'commandepar', 1),
+        (r'aswak', -3),
+    ],
+    'aswakessalam': [
+        (r'g\.o\.l\.d\.report', 1),
+        (r'aswak(as|es)salam', 3),
+        (r'qteenstock', 2),
+        (r'commandepar', 1),
+        (r"label'?vie", -3),
+    ],
+    'kazyon': [
+        (r'articlemateriel', 3),
+        (r'codeean', 1),
+        (r'unites\(colis\)', 2),
+        (r'qtetotal', 1),
+        (r'commandepar', -3),
+    ],
+}
+
+_compiled = {layout: [(re.compile(pattern), weight) for pattern, weight in features]
+             for layout, features in LAYOUTS.items()}
+
+
+def compact_text(text):
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'\s+', '', text.lower())
+
+
+def header_text(pdf_path, region=HEADER_REGION):
+    # Text of the top of page 1 only; no table detection and no other page is parsed
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path, pages=[1]) as pdf:
+        page = pdf.pages[0]
+        text = page.crop((0, 0, page.width, page.height * region)).extract_text() or ''
+        page.close()
+    return text
+
+
+def score_layouts(text):
+    # Confidence per layout: matched feature weight over the layout's total positive weight
+    compact = compact_text(text)
+    scores = {}
+    for layout, features in _compiled.items():
+        total = sum(weight for _, weight in features if weight > 0)
+        matched = sum(weight for pattern, weight in features if pattern.search(compact))
+        scores[layout] = max(0.0, matched / total)
+    return scores
+
+
+def fingerprint(pdf_path):
+    # Return (layout, confidence) for the PDF, layout is None below MIN_CONFIDENCE
+    with metrics.timer('fingerprint'):
+        scores = score_layouts(header_text(pdf_path))
+    layout = max(scores, key=scores.get)
+    confidence = round(scores[layout], 3)
+    if confidence < MIN_CONFIDENCE:
+        return None, confidence
+    return layout, confidence
+
+
+def route(pdf_path):
+    # Retailer parser to use for the PDF; unknown or unsupported layouts raise ValueError
+    layout, confidence = fingerprint(pdf_path)
+    if layout is None:
+        raise ValueError(f"Unrecognized purchase-order layout (best confidence {confidence})")
+    if layout not in PARSERS:
+        raise ValueError(f"No parser for the {layout} layout yet (confidence {confidence})")
+    return layout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect the retailer layout of purchase-order PDFs from page 1")
+    parser.add_argument('pdfs', nargs='+')
+    args = parser.parse_args(argv)
+    unknown = 0
+    for pdf_path in args.pdfs:
+        layout, confidence = fingerprint(pdf_path)
+        unknown += layout is None
+        print(f"{layout or 'unknown':12} {confidence:5.3f}  {pdf_path}")
+    return 1 if unknown else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
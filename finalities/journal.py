@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DEFAULT_JOURNAL = os.path.join(os.path.expanduser('~'), '.cache', 'finalities', 'journal.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    file_hash TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    retailer TEXT NOT NULL DEFAULT '',
+    order_ref TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    output TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    updated TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_by_ref ON orders (retailer, order_ref, status);
+"""
+
+# Statuses after which a PDF is never converted again: exported, or found to
+# repeat a PO number already exported from another PDF
+COMPLETED = ('ok', 'duplicate')
+
+FIELDS = ('file_hash', 'file', 'retailer', 'order_ref', 'status', 'output', 'error', 'updated')
+
+
+class Journal:
+    # Order-level record of every PDF a batch or the daemon handled, so a run that
+    # died halfway can be restarted without converting an order twice. Rows are
+    # keyed by the PDF content hash (the same one as the extraction cache) and
+    # indexed by retailer and PO number (CUSORDREF), so both "was this file already
+    # converted?" and "was this PO already converted from another file?" are one
+    # index lookup however many orders the journal holds. Every record is committed
+    # at once: a crash loses at most the order being exported.
+
+    def __init__(self, path=DEFAULT_JOURNAL):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _one(self, sql, args):
+        with self.lock:
+            row = self.connection.execute(sql, args).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def find_file(self, file_hash):
+        # The journal row of a PDF with this content, None if it was never seen
+        return self._one(f"SELECT {', '.join(FIELDS)} FROM orders WHERE file_hash = ?", (file_hash,))
+
+    def find_order(self, retailer, order_ref):
+        # The row of the completed order with this PO number, None if there is none
+        if not order_ref:
+            return None
+        return self._one(f"SELECT {', '.join(FIELDS)} FROM orders "
+                         "WHERE retailer = ? AND order_ref = ? AND status = 'ok' LIMIT 1",
+                         (retailer or '', str(order_ref)))
+
+    def record(self, file_hash, file, status, retailer='', order_ref='', output='', error=''):
+        # Insert or replace the row of a PDF, committed before returning
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO orders ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                (file_hash, file, retailer or '', str(order_ref or ''), status, output or '', error or '',
+                 datetime.now().isoformat(timespec='seconds')))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,178 @@
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DEFAULT_MEMO = os.path.join(os.path.expanduser('~'), '.cache', 'finalities', 'matches.sqlite')
+
+# Memoized matches scoring below this are listed for operators to confirm or override
+REVIEW_SCORE = 80
+
+# Score reported for a store resolved through an operator alias
+ALIAS_SCORE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS matches (
+    noise TEXT NOT NULL,
+    query TEXT NOT NULL,
+    den TEXT,
+    uid TEXT,
+    score REAL NOT NULL,
+    PRIMARY KEY (noise, query)
+);
+CREATE TABLE IF NOT EXISTS aliases (
+    query TEXT PRIMARY KEY,
+    uid TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+"""
+
+
+def normalize_store(text):
+    # Memo key of a store text: case and runs of whitespace are folded, the rest
+    # is kept as is since punctuation and noise words affect the match
+    return ' '.join(str(text).split()).lower()
+
+
+class MatchMemo:
+    # Persistent store text -> (Den, UID, score) memo for ClientIndex, so a store
+    # seen on an earlier order costs one dict lookup instead of fuzzy scoring.
+    #
+    # matches  every computed match, per set of noise words; all of them are
+    #          dropped when the clients table changes (bind() with a new version)
+    # aliases  operator decisions for a store text, kept across client changes:
+    #          'confirmed' (the memoized match is right) or 'override' (another
+    #          UID). An alias wins over fuzzy matching as long as its UID exists.
+    #
+    # The current version's matches and all aliases are held in memory; every new
+    # match is written through to SQLite at once. Safe to share between threads.
+
+    def __init__(self, path=DEFAULT_MEMO):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.version = None
+        self.matches = {}
+        self.aliases = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def bind(self, version):
+        # Use the memo for the clients table with this version; memoized matches
+        # of any other version are deleted
+        with self.lock:
+            if version == self.version:
+                return
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'clients_version'").fetchone()
+            with self.connection:
+                if row is None or row[0] != version:
+                    self.connection.execute("DELETE FROM matches")
+                    self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('clients_version', ?)", (version,))
+            self.version = version
+            self.matches = {(noise, query): (den, uid, score) for noise, query, den, uid, score
+                            in self.connection.execute("SELECT noise, query, den, uid, score FROM matches")}
+            self.aliases = dict(self.connection.execute("SELECT query, uid FROM aliases"))
+
+    def alias(self, query):
+        return self.aliases.get(query)
+
+    def get(self, noise, query):
+        # Memoized (Den, UID, score), None when the store was never matched
+        return self.matches.get((noise, query))
+
+    def put(self, noise, query, result):
+        den, uid, score = result
+        with self.lock, self.connection:
+            self.matches[(noise, query)] = result
+            self.connection.execute("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)",
+                                    (noise, query, den, uid, score))
+
+    def review(self, below=REVIEW_SCORE):
+        # Memoized matches scoring below `below` that no operator decided on yet
+        with self.lock:
+            return self.connection.execute(
+                "SELECT query, den, uid, MIN(score) FROM matches WHERE score < ? "
+                "AND query NOT IN (SELECT query FROM aliases) GROUP BY query, den, uid ORDER BY MIN(score)",
+                (below,)).fetchall()
+
+    def set_alias(self, query, uid, status):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?, ?, ?)",
+                                    (query, uid, status, datetime.now().isoformat(timespec='seconds')))
+            self.aliases[query] = uid
+
+    def confirm(self, text):
+        # Keep the memoized match of a store text as its alias; returns the UID
+        query = normalize_store(text)
+        with self.lock:
+            row = self.connection.execute("SELECT uid FROM matches WHERE query = ? AND uid IS NOT NULL "
+                                          "ORDER BY score DESC LIMIT 1", (query,)).fetchone()
+        if row is None:
+            raise ValueError(f"No memoized match for '{text}'")
+        self.set_alias(query, row[0], 'confirmed')
+        return row[0]
+
+    def override(self, text, uid):
+        # Resolve a store text to the given client UID from now on
+        self.set_alias(normalize_store(text), uid, 'override')
+        return uid
+
+    def forget(self, text):
+        # Drop the alias and the memoized matches of a store text
+        query = normalize_store(text)
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM aliases WHERE query = ?", (query,))
+            self.connection.execute("DELETE FROM matches WHERE query = ?", (query,))
+            self.aliases.pop(query, None)
+            for key in [key for key in self.matches if key[1] == query]:
+                del self.matches[key]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Review the memoized store matches and manage store aliases")
+    parser.add_argument('--memo', default=DEFAULT_MEMO, help="Match memo database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    review = commands.add_parser('review', help="List memoized matches with a low score")
+    review.add_argument('--below', type=float, default=REVIEW_SCORE)
+    confirm = commands.add_parser('confirm', help="Accept the memoized match of a store")
+    confirm.add_argument('store')
+    override = commands.add_parser('override', help="Resolve a store to a given client UID")
+    override.add_argument('store')
+    override.add_argument('uid')
+    forget = commands.add_parser('forget', help="Drop a store's alias and memoized matches")
+    forget.add_argument('store')
+    args = parser.parse_args(argv)
+
+    with MatchMemo(args.memo) as memo:
+        if args.command == 'review':
+            rows = memo.review(args.below)
+            for query, den, uid, score in rows:
+                print(f"{score:5.1f}  {query!r} -> {uid} ({den})")
+            print(f"{len(rows)} matches below {args.below}")
+        elif args.command == 'confirm':
+            print(f"{args.store!r} -> {memo.confirm(args.store)} (confirmed)")
+        elif args.command == 'override':
+            print(f"{args.store!r} -> {memo.override(args.store, args.uid)} (override)")
+        else:
+            memo.forget(args.store)
+            print(f"Forgot {args.store!r}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,50 @@
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    # Highest resident set size of this process so far, in bytes (None where unknown)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryTracker:
+    # Peak memory of a block of code: the process's peak RSS, plus the peak of
+    # Python allocations when trace=True (tracemalloc, which slows the block down)
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.started = False
+        self.peak = None
+        self.rss = None
+
+    def __enter__(self):
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started = True
+            tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            if self.started:
+                tracemalloc.stop()
+        self.rss = peak_rss()
+
+    def report(self):
+        parts = []
+        if self.peak is not None:
+            parts.append(f"{self.peak / 2 ** 20:.1f} MB traced")
+        if self.rss is not None:
+            parts.append(f"{self.rss / 2 ** 20:.1f} MB peak RSS")
+        return ', '.join(parts) or 'not available'
@@ -0,0 +1,136 @@
+import contextvars
+import cProfile
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# One JSON object per order is logged here at INFO level
+logger = logging.getLogger('finalities.orders')
+
+# Metrics of the order being processed in the current thread or task, None outside an order
+_current = contextvars.ContextVar('order_metrics', default=None)
+
+
+class OrderMetrics:
+    # Timers (seconds) and counters of one order. The hot path only calls timer()
+    # and count() below, which do nothing when no order is being measured.
+    #
+    # Timers: pdf_open, fingerprint, table_extraction, classification, db_query,
+    #         ean_resolve, fuzzy_match, csv_write
+    # Counters: pages, tables, db_queries, eans, eans_unmatched, fuzzy_queries,
+    #           fuzzy_candidates, fuzzy_memo_hits, lines_written, lines_rejected,
+    #           layout_fallbacks, tabula_batched
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def merge(self, other):
+        # Add the timers and counters of another OrderMetrics or of its as_dict()
+        other = other.as_dict() if isinstance(other, OrderMetrics) else other
+        for name, seconds in other.get('timers', {}).items():
+            self.timers[name] += seconds
+        for name, value in other.get('counters', {}).items():
+            self.counters[name] += value
+
+    def as_dict(self):
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.started
+        return dict(self.fields, seconds=round(seconds, 6),
+                    timers={name: round(value, 6) for name, value in sorted(self.timers.items())},
+                    counters=dict(sorted(self.counters.items())))
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def timer(name):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timers[name] += time.perf_counter() - start
+
+
+def count(name, value=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[name] += value
+
+
+@contextmanager
+def measure(**fields):
+    # Collect the metrics of the code run inside the block, without logging them
+    metrics = OrderMetrics(**fields)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        metrics.seconds = time.perf_counter() - metrics.started
+        _current.reset(token)
+
+
+@contextmanager
+def order_metrics(**fields):
+    # Measure one order and log its metrics as a JSON line when the block ends,
+    # with status 'ok' or 'failed' and the error when it raised
+    with measure(**fields) as metrics:
+        try:
+            yield metrics
+        except BaseException as error:
+            metrics.fields.update(status='failed', error=f"{type(error).__name__}: {error}")
+            raise
+        else:
+            metrics.fields.setdefault('status', 'ok')
+        finally:
+            metrics.seconds = time.perf_counter() - metrics.started
+            logger.info(json.dumps(metrics.as_dict(), default=str))
+
+
+def setup_logging(metrics_log=None, verbose=False):
+    # Progress messages on stderr (DEBUG with verbose); per-order JSON metrics
+    # appended to metrics_log when given, on stderr otherwise
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO, format='%(message)s')
+    if metrics_log:
+        handler = logging.FileHandler(metrics_log)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+@contextmanager
+def profiled(path, profiler='cprofile'):
+    # Profile the block into path: a cProfile stats file (open with pstats or
+    # snakeviz), or an HTML report with pyinstrument when it is installed
+    if not path:
+        yield
+        return
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(path, 'w') as file:
+                file.write(profile.output_html())
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
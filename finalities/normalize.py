@@ -0,0 +1,110 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from finalities import metrics
+from finalities.sage import E_FIELDS, atomic_open
+
+logger = logging.getLogger(__name__)
+
+# How each retailer prints its order and delivery dates
+DATE_FORMATS = {
+    'marjane': '%d/%m/%Y',
+    'vracmarjane': '%d/%m/%y%H:%M',
+    'labelvie': '%d/%m/%y %H:%M',
+}
+
+SAGE_DATE_FORMAT = '%Y%m%d'
+
+# Columns of the reject report written next to an order's Sage file
+REJECT_FIELDS = ('CUSORDREF', 'BPCORD', 'LINE', 'EAN', 'ITMREF', 'QTY', 'REASON')
+
+
+def sage_dates(values, date_format):
+    # Convert a column of dates printed with date_format to Sage YYYYMMDD strings in
+    # one to_datetime call; unparseable or missing dates become ''
+    dates = pd.to_datetime(pd.Series(values, dtype=object), format=date_format, errors='coerce')
+    return dates.dt.strftime(SAGE_DATE_FORMAT).fillna('')
+
+
+def sage_date(value, date_format):
+    return sage_dates([value], date_format).iloc[0]
+
+
+def quantities(values):
+    # Numbers from tabula values or PDF text ('50', '50.000', '1 200', '12,5'); NaN otherwise
+    text = pd.Series(values).astype('string').str.replace(r'\s+', '', regex=True).str.replace(',', '.', regex=False)
+    return pd.to_numeric(text, errors='coerce').astype(float)
+
+
+def quantity_text(qty):
+    # Sage QTY text: whole quantities without the decimals the PDF or pandas added
+    text = pd.Series('', index=qty.index, dtype=object)
+    whole = qty.notna() & (qty == qty.round())
+    text[whole] = qty[whole].astype('int64').astype(str)
+    fractional = qty.notna() & ~whole
+    text[fractional] = qty[fractional].astype(str)
+    return text
+
+
+def normalize_lines(lines, eans=None, first_line=1):
+    # Check and normalize the L records of an order in one pass. Lines without an
+    # ITMREF (EAN not resolved to a UID) or without a positive quantity are set
+    # apart; the others get their QTY normalized. Returns (lines, rejects), the
+    # rejects holding the original EAN and line number for the reject report.
+    qty = quantities(lines['QTY'])
+    itmref = lines['ITMREF'].astype('string').str.strip()
+    unresolved = (itmref.isna() | (itmref == '')).to_numpy()
+    bad_quantity = (qty.isna() | (qty <= 0)).to_numpy()
+    rejected = unresolved | bad_quantity
+
+    positions = np.flatnonzero(rejected)
+    rejects = pd.DataFrame({
+        'LINE': positions + first_line,
+        'EAN': (np.asarray(eans, dtype=object)[positions] if eans is not None else ''),
+        'ITMREF': lines['ITMREF'].to_numpy()[positions],
+        'QTY': lines['QTY'].to_numpy()[positions],
+        'REASON': np.where(unresolved[positions] & bad_quantity[positions], 'unknown EAN, bad quantity',
+                           np.where(unresolved[positions], 'unknown EAN', 'bad quantity')),
+    })
+    metrics.count('lines_rejected', len(rejects))
+
+    lines = lines[~rejected].copy()
+    lines['QTY'] = quantity_text(qty[~rejected])
+    return lines, rejects
+
+
+def rejects_path(output_file):
+    return os.path.splitext(output_file)[0] + '.rejects.csv'
+
+
+def write_rejects(output_file, header, rejects):
+    # Write an order's rejected lines to <output>.rejects.csv, or hand them to the
+    # bundle order (finalities.bundle.BundleOrder) the order is written to.
+    header = dict(zip(E_FIELDS, header))
+    rejects = rejects.assign(CUSORDREF=header['CUSORDREF'], BPCORD=header['BPCORD'])[list(REJECT_FIELDS)]
+    if not isinstance(output_file, (str, os.PathLike)):
+        output_file.add_rejects(rejects)
+        return None
+    return save_rejects(rejects_path(output_file), rejects)
+
+
+def save_rejects(path, rejects):
+    # Atomically write a reject report; a report left by an earlier run of the same
+    # order is removed when nothing was rejected
+    if rejects.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    with atomic_open(path) as file:
+        rejects.to_csv(file, sep=';', index=False, lineterminator='\n')
+    logger.warning("%d lines of order %s rejected, see %s", len(rejects), rejects['CUSORDREF'].iloc[0], path)
+    return path
+
+
+def check_lines_left(count):
+    # An order whose every line was rejected is not exported
+    if count == 0:
+        raise ValueError("Every product line was rejected (unknown EANs or bad quantities)")
@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+
+# A worker process is only started for at least this many pages
+MIN_PAGES_PER_WORKER = 4
+
+
+def page_count(pdf_path):
+    # Number of pages of a PDF; pdfplumber is only imported when it is needed
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def page_chunks(page_count, workers, min_pages=MIN_PAGES_PER_WORKER):
+    # Split pages 1..page_count into contiguous ranges of near-equal size, one per worker
+    workers = max(1, min(workers, page_count // min_pages))
+    size, extra = divmod(page_count, workers)
+    chunks = []
+    start = 1
+    for index in range(workers):
+        end = start + size + (index < extra)
+        chunks.append(list(range(start, end)))
+        start = end
+    return chunks
+
+
+def map_pages(function, pdf_path, page_count, workers, min_pages=MIN_PAGES_PER_WORKER):
+    # Run function(pdf_path, page_numbers), which returns one result per page, over
+    # the pages of a PDF split across worker processes. Results come back in page
+    # order, so merging them gives the same result as a single sequential call.
+    chunks = page_chunks(page_count, workers, min_pages)
+    if len(chunks) == 1:
+        return function(pdf_path, chunks[0])
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        results = pool.map(function, [pdf_path] * len(chunks), chunks)
+        return [page for chunk in results for page in chunk]
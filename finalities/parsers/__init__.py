@@ -0,0 +1,38 @@
+import importlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Retailer name -> parser module. Every parser module exposes:
+#   extract_tables(pdf_path)                    PDF -> {table name: DataFrame}, no database access
+#   export_order(tables, output_file, cache, debug_dir=None)     resolve UIDs and write the Sage ERP file
+#   process_order(pdf_path, output_file, cache, debug_dir=None)  both of the above
+#   order_reference(tables)                     PO number (CUSORDREF) of the extracted order, or None
+# Parsers reading with tabula also expose tabula_pass(), the read_pdf() options
+# of their first tabula call, so batch runs can read several PDFs in one call.
+# Tables stay in memory between the two steps; debug_dir, when given, receives
+# a CSV copy of every classified table for inspection. output_file is a path, or
+# a finalities.bundle.BundleOrder when orders are packed into consolidated files.
+PARSERS = {
+    'marjane': 'finalities.parsers.marjane',
+    'vracmarjane': 'finalities.parsers.vracmarjane',
+    'labelvie': 'finalities.parsers.labelvie',
+}
+
+
+def get_parser(retailer):
+    if retailer not in PARSERS:
+        raise ValueError(f"Unknown retailer '{retailer}', expected one of: {', '.join(PARSERS)}")
+    return importlib.import_module(PARSERS[retailer])
+
+
+def save_debug_tables(tables, debug_dir, output_file):
+    # Write each table to <debug_dir>/<order>_<table>.csv; the order prefix keeps
+    # runs sharing the directory apart
+    os.makedirs(debug_dir, exist_ok=True)
+    order = os.path.splitext(os.path.basename(str(output_file)))[0]
+    for name, df in tables.items():
+        csv_path = os.path.join(debug_dir, f"{order}_{name.replace(' ', '_')}.csv")
+        df.to_csv(csv_path, index=False)
+        logger.debug("Saved %s", csv_path)
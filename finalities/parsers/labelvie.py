@@ -0,0 +1,152 @@
+import logging
+
+import pandas as pd
+
+from finalities import metrics, tabula_jvm
+from finalities.normalize import DATE_FORMATS, check_lines_left, normalize_lines, sage_dates, write_rejects
+from finalities.parsers import save_debug_tables
+from finalities.refcache import get_reference_cache
+from finalities.regions import tabula_options
+from finalities.sage import order_header, order_lines, write_order
+from finalities.tables import TableAccumulator
+
+logger = logging.getLogger(__name__)
+
+# Bump when extract_tables() output changes, to invalidate cached extractions
+EXTRACTOR_VERSION = 2
+
+# Define the expected headers and their corresponding names
+expected_headers_with_names = {
+    'orderer_details': ['Commande par', 'Livre a', 'Commande a'],
+    'products_detail': ['Code externe', 'Code EAN', 'Libelle article', 'Type U.C.', 'VL', 'No ligne', 'UVC/UC', 'Quant en UC', 'No opera speci', 'ion le'],
+    'order_information': ['No commande', 'Date commande', 'Code fournisseur', 'Contrat commercial', 'Filiere'],
+    'delivery_details': ['Date de livraison souhaitee', 'Date de livraison limite']
+}
+
+
+# Normalize the expected headers by joining split lines and removing extra spaces
+def normalize_header(header):
+    return [' '.join(col.split()).replace('\n', ' ').replace('\r', ' ').strip() for col in header]
+
+
+normalized_expected_headers_with_names = {name: normalize_header(header) for name, header in expected_headers_with_names.items()}
+
+# Where table detection runs: under the "BON DE COMMANDE" banner repeated at the top
+# of every page. The header cells only read right (with their spaces) through tabula,
+# so the order tables are detected with the product tables in a single lattice pass.
+TEMPLATE = {
+    'tables': {'pages': 'all', 'bbox': (0, 0.11, 1, 0.96)},
+}
+
+# Text columns are typed explicitly; quantities keep the numeric type tabula detected
+table_dtypes = {
+    'orderer_details': {column: 'string' for column in normalized_expected_headers_with_names['orderer_details']},
+    'products_detail': {'Code externe': 'string', 'Code EAN': 'string', 'Libelle article': 'string', 'Type U.C.': 'string'},
+    'order_information': {column: 'string' for column in normalized_expected_headers_with_names['order_information']},
+    'delivery_details': {column: 'string' for column in normalized_expected_headers_with_names['delivery_details']},
+}
+
+
+def modify_code_ean_column(table_df, resolver):
+    # Unknown EANs are left empty, the EANs are kept in 'EAN' for the reject report
+    resolver.map_column(table_df, 'Code EAN', keep_unmatched=False, source_column='EAN')
+
+
+def generate_erp_sage_csv(orderer_df, order_info_df, delivery_df, products_df, output_file):
+    # Convert date columns to Sage dates using the LabelVie format
+    order_dates = sage_dates(order_info_df['Date commande'], DATE_FORMATS['labelvie'])
+    shipment_dates = sage_dates(delivery_df['Date de livraison souhaitee'], DATE_FORMATS['labelvie'])
+
+    # One E line per order, then the L lines straight from the product columns
+    header = order_header(
+        BPCORD=orderer_df['Commande par'].iloc[0],
+        ORDDAT=order_dates.iloc[0],
+        CUSORDREF=order_info_df['No commande'].iloc[0],
+        EXPDATE=shipment_dates.iloc[0],
+    )
+    lines, rejects = normalize_lines(
+        order_lines(products_df['Code EAN'], products_df['Quant en UC'], sau=products_df['Type U.C.']),
+        products_df['EAN'])
+    write_rejects(output_file, header, rejects)
+    check_lines_left(len(lines))
+    return write_order(output_file, header, lines)
+
+
+def tabula_pass():
+    # read_pdf() options of the extraction, also used to read a batch of PDFs in
+    # one tabula call ahead of extract_tables() (tabula_jvm.prefetch)
+    return dict(multiple_tables=True, lattice=True, **tabula_options(TEMPLATE['tables']))
+
+
+def extract_tables(pdf_path):
+    # Extract tables from the PDF using the lattice method
+    tables = tabula_jvm.read_pdf(pdf_path, **tabula_pass())
+
+    logger.debug("Total tables extracted: %d", len(tables))
+
+    with metrics.timer('classification'):
+        # Collect the matching tables per name and concatenate each name once at the end
+        accumulator = TableAccumulator(columns=normalized_expected_headers_with_names, dtypes=table_dtypes)
+
+        # Loop through the tables and concatenate those with matching headers
+        for i, table in enumerate(tables):
+            table_headers = [' '.join(col.split()).replace('\n', ' ').replace('\r', ' ').strip() for col in table.columns.tolist()]
+            logger.debug("Table %d headers: %s", i + 1, table_headers)
+
+            for name, expected in normalized_expected_headers_with_names.items():
+                if all(header in table_headers for header in expected):
+                    table.columns = normalized_expected_headers_with_names[name]
+                    accumulator.add_frame(name, table)
+                    logger.debug("Table %d concatenated to %s", i + 1, name)
+                    break
+            else:
+                logger.debug("Table %d does not match expected headers.", i + 1)
+
+        return accumulator.build()
+
+
+def order_reference(tables):
+    # PO number of the extracted order (CUSORDREF), None when it was not found
+    order_information = tables.get('order_information')
+    if order_information is None or order_information.empty or 'No commande' not in order_information.columns:
+        return None
+    reference = order_information['No commande'].iloc[0]
+    return None if pd.isna(reference) else str(reference).strip() or None
+
+
+def export_order(tables, output_file, reference_cache=None, debug_dir=None):
+    reference_cache = reference_cache or get_reference_cache()
+
+    # EANs are resolved from the cached products map, without any per-order query
+    modify_code_ean_column(tables['products_detail'], reference_cache.product_resolver())
+
+    orderer_df = tables['orderer_details']
+    if 'Commande par' in orderer_df.columns:
+        matches = reference_cache.client_index().match_many(orderer_df['Commande par'])
+        for index, (closest_match, uid, score) in zip(orderer_df.index, matches):
+            if uid:
+                orderer_df.at[index, 'Commande par'] = uid
+
+    # Save concatenated tables to CSV
+    if debug_dir:
+        save_debug_tables({name: df for name, df in tables.items() if not df.empty}, debug_dir, output_file)
+
+    # Generate ERP Sage CSV
+    if (tables['orderer_details'].empty or
+            tables['order_information'].empty or
+            tables['delivery_details'].empty or
+            tables['products_detail'].empty):
+        return None
+    generate_erp_sage_csv(
+        tables['orderer_details'],
+        tables['order_information'],
+        tables['delivery_details'],
+        tables['products_detail'],
+        output_file
+    )
+    logger.info("ERP Sage CSV generated and saved at %s", output_file)
+    return output_file
+
+
+def process_order(pdf_path, output_file, reference_cache=None, debug_dir=None):
+    return export_order(extract_tables(pdf_path), output_file, reference_cache, debug_dir)
@@ -0,0 +1,173 @@
+import logging
+from datetime import datetime
+
+import pandas as pd
+
+from finalities import metrics, tabula_jvm
+from finalities.normalize import DATE_FORMATS, check_lines_left, normalize_lines, sage_date, write_rejects
+from finalities.parsers import save_debug_tables
+from finalities.refcache import get_reference_cache
+from finalities.pages import page_count
+from finalities.regions import page_numbers, search_fields, tabula_options
+from finalities.sage import order_header, order_lines, write_order
+from finalities.stores import NOISE_WORDS, strip_noise_words
+from finalities.tables import TableAccumulator
+
+logger = logging.getLogger(__name__)
+
+# Bump when extract_tables() output changes, to invalidate cached extractions
+EXTRACTOR_VERSION = 3
+
+# Define patterns for extracting Site, Commande, and Date livraison prevue from order text
+patterns = {
+    "Site": r'Site\s*:\s*([^\n]+)',
+    "Commande": r'Commande\s*:\s*([\d]+)',
+    "Date Livraison Prevue": r'Date Livraison Prevue\s*:\s*([\d/]+)',
+    "Total lignes": r'Total lignes\s*:\s*(\d+)',
+}
+
+# Where the order fields and the product table sit on the portal's purchase order
+TEMPLATE = {
+    # Fournisseur/Commande/Site/Date lines under the title, down to "Total lignes"
+    'order details': {'pages': 'first', 'bbox': (0, 0, 1, 0.193)},
+    # Product table from its header row down to the page number; on the next pages
+    # the table starts at the top of the page
+    'products details': [
+        {'pages': 'first', 'bbox': (0, 0.195, 1, 0.96)},
+        {'pages': 'rest', 'bbox': (0, 0.03, 1, 0.96)},
+    ],
+}
+
+
+def line_count(order_fields):
+    # Product lines the portal says the order has ("Total lignes"), None when not printed
+    total = order_fields.get('Total lignes')
+    return int(total) if total is not None else None
+
+
+def continuation_pages(pdf_path, header):
+    # Product table chunks of pages 2 and up, with page 1's columns. Their header
+    # row, when repeated, is dropped. A one-page order has none.
+    first, rest = TEMPLATE['products details']
+    count = page_count(pdf_path)
+    if not page_numbers(rest['pages'], count):
+        return
+    chunks = tabula_jvm.read_pdf(pdf_path, multiple_tables=True, encoding='latin1', pandas_options={'header': None},
+                                 **tabula_options(rest, count))
+    for number, chunk in enumerate(chunks, 2):
+        if chunk.empty:
+            continue
+        if chunk.shape[1] != len(header):
+            raise ValueError(f"Product table of page {number} has {chunk.shape[1]} columns instead of {len(header)}")
+        chunk.columns = header
+        yield chunk[chunk[header[0]].astype('string').str.strip() != header[0]]
+
+
+def tabula_pass():
+    # read_pdf() options of the first pass, also used to read a batch of PDFs in
+    # one tabula call ahead of extract_tables() (tabula_jvm.prefetch)
+    return dict(multiple_tables=True, encoding='latin1',
+                **tabula_options([TEMPLATE['order details'], TEMPLATE['products details'][0]]))
+
+
+def extract_tables(pdf_path):
+    # Read the order header and the product table of page 1 in one tabula pass,
+    # one table per template region, without table detection over the whole document.
+    # When "Total lignes" says the table goes on, the product area of the next
+    # pages is read in a second pass and every page's chunk accumulated.
+    tables = tabula_jvm.read_pdf(pdf_path, **tabula_pass())
+    if len(tables) < 2:
+        return {}
+
+    with metrics.timer('classification'):
+        # Extracting raw text from the header region for order details
+        order_text = tables[0].to_string(index=False)
+        logger.debug("Order text extracted from PDF:\n%s", order_text)
+
+        # Extract Site, Commande, and Date livraison prevue using regex
+        order_fields = search_fields(order_text, patterns)
+    for key in patterns:
+        if key in order_fields:
+            logger.debug("%s extracted: %s", key, order_fields[key])
+        else:
+            logger.debug("%s not found", key)
+
+    accumulator = TableAccumulator()
+    accumulator.add_frame('products details', tables[1])
+    total = line_count(order_fields)
+    if total is None or total > len(tables[1]):
+        for chunk in continuation_pages(pdf_path, list(tables[1].columns)):
+            accumulator.add_frame('products details', chunk)
+    accumulator.add_frame('order details', pd.DataFrame([order_fields]))
+    return accumulator.build()
+
+
+def order_reference(tables):
+    # PO number of the extracted order (CUSORDREF), None when it was not found
+    order_details = tables.get('order details')
+    if order_details is None or order_details.empty or 'Commande' not in order_details.columns:
+        return None
+    reference = order_details['Commande'].iloc[0]
+    return None if pd.isna(reference) else str(reference).strip() or None
+
+
+def export_order(tables, output_file, reference_cache=None, debug_dir=None):
+    reference_cache = reference_cache or get_reference_cache()
+    product_details = tables['products details']
+
+    # Map Code Article to UID, keeping the EANs for the reject report
+    reference_cache.product_resolver().map_column(product_details, 'Code Article', keep_unmatched=False,
+                                                  source_column='EAN')
+
+    order_fields = tables['order details'].iloc[0].dropna().to_dict()
+
+    # Every line the portal printed must have been read, or the order would be short
+    total = line_count(order_fields)
+    if total is None:
+        raise ValueError("Total lignes not found in the order.")
+    if total != len(product_details):
+        raise ValueError(f"Read {len(product_details)} product lines but the order has {total} (Total lignes)")
+
+    # Remove specific words from site name if present
+    site = strip_noise_words(order_fields["Site"])
+
+    # Find the closest match for Site and get its UID
+    client_index = reference_cache.client_index(noise_words=NOISE_WORDS)
+
+    # Format the Date Livraison Prevue to the desired format if it was found
+    if "Date Livraison Prevue" not in order_fields:
+        raise ValueError("Date Livraison Prevue not found in the order.")
+    delivery_date = sage_date(order_fields["Date Livraison Prevue"], DATE_FORMATS['marjane'])
+    if not delivery_date:
+        raise ValueError(f"Date Livraison Prevue is not a date: {order_fields['Date Livraison Prevue']!r}")
+
+    # Prepare header and lines for Sage ERP CSV
+    header = order_header(
+        BPCORD=client_index.match(site)[1],
+        ORDDAT=datetime.today().strftime('%Y%m%d'),
+        CUSORDREF=order_fields["Commande"],  # Set CUSORDREF from Commande
+        EXPDATE=delivery_date,
+    )
+    # Lines with an unknown EAN or a bad quantity go to the reject report
+    lines, rejects = normalize_lines(order_lines(product_details['Code Article'], product_details['Qte Cmd UA']),
+                                     product_details['EAN'])
+
+    # Keep a copy of the extracted tables only when asked to
+    if debug_dir:
+        save_debug_tables(tables, debug_dir, output_file)
+
+    # Write to CSV
+    write_rejects(output_file, header, rejects)
+    check_lines_left(len(lines))
+    write_order(output_file, header, lines)
+
+    logger.info("Sage ERP CSV created successfully at %s", output_file)
+    return output_file
+
+
+def process_order(pdf_path, output_file, reference_cache=None, debug_dir=None):
+    tables = extract_tables(pdf_path)
+    if not tables:
+        logger.warning("No tables found in the PDF.")
+        return None
+    return export_order(tables, output_file, reference_cache, debug_dir)
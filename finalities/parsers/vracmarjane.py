@@ -0,0 +1,330 @@
+import logging
+import re
+
+import pandas as pd
+import pdfplumber
+
+from finalities import metrics
+from finalities.memory import MemoryTracker
+from finalities.normalize import DATE_FORMATS, check_lines_left, normalize_lines, sage_date, write_rejects
+from finalities.pages import map_pages
+from finalities.parsers import save_debug_tables
+from finalities.refcache import get_reference_cache
+from finalities.regions import crop, page_areas
+from finalities.sage import LineSpool, order_header, order_lines, write_order
+from finalities.tables import TableAccumulator
+
+logger = logging.getLogger(__name__)
+
+# Bump when extract_tables() output changes, to invalidate cached extractions
+EXTRACTOR_VERSION = 3
+
+# Define header-to-name mapping
+header_to_name = {
+    tuple(['Nocommande', 'Datecommande', 'Codefournisseur', 'Contratcommercial', 'Filiere', 'Etatcommande']): 'order details',
+    tuple(['Commandepar', 'Livrea', 'Commandea']): 'ordered details',
+    tuple(['Article', 'Libellearticle', 'VL', 'Noligne', 'TypeU.C.', 'Quanten\nUC', 'UVC/UC', 'Quanten\nUVC', 'No.operation\nspeciale']): 'products details',
+    tuple(['Datedelivraisonsouhaitee', 'Datedelivraisonlimite']): 'delivery details'
+}
+
+# Where table detection runs. The order and orderer tables only matter on page 1
+# (the order table repeats under every page title); product lines follow them on
+# page 1 and start under the repeated order table on the next pages, and the
+# delivery table comes after the last product line. The header/body boundary is
+# only the default: on each page it is moved to the product table's header row
+# when that row is found (see page_regions), since a longer orderer or delivery
+# address pushes the product table down.
+TEMPLATE = {
+    'header': {'pages': 'first', 'bbox': (0, 0, 1, 0.275)},
+    'body': [
+        {'pages': 'first', 'bbox': (0, 0.275, 1, 1)},
+        {'pages': 'rest', 'bbox': (0, 0.115, 1, 1)},
+    ],
+}
+
+# Points kept above the product table's header row when the regions are split there
+SPLIT_MARGIN = 2
+
+# Tables page 1 must give with their rows; when one is missing from the regions the
+# whole page is read
+FIRST_PAGE_TABLES = {'order details', 'ordered details'}
+
+# Product rows resolved and spooled at a time by stream_order()
+STREAM_CHUNK_ROWS = 500
+
+# pdfplumber cells are text; every column is kept as a string column
+table_dtypes = {name: {column: 'string' for column in headers} for headers, name in header_to_name.items()}
+
+
+def modify_article_column(table_df, resolver):
+    # Replace every EAN in the 'Article' column with its UID in one vectorized step;
+    # unknown EANs are left empty, the EANs are kept in 'EAN' for the reject report
+    resolver.map_column(table_df, 'Article', keep_unmatched=False, source_column='EAN')
+
+
+def reformat_date(date_str):
+    return sage_date(date_str, DATE_FORMATS['vracmarjane'])
+
+
+def check_tables(ordered_details, order_details, delivery_details, products_details):
+    if ordered_details is None:
+        logger.warning("ordered_details table is missing.")
+    if order_details is None:
+        logger.warning("order_details table is missing.")
+    if delivery_details is None:
+        logger.warning("delivery_details table is missing.")
+    if products_details is None:
+        logger.warning("products_details table is missing.")
+
+    if ordered_details is None or order_details is None or delivery_details is None or products_details is None:
+        logger.warning("One or more required tables are missing.")
+        return False
+    return True
+
+
+def build_header(ordered_details, order_details, delivery_details):
+    # Build the E line from the order tables
+    return order_header(
+        BPCORD=ordered_details['Commandepar'].iloc[0] if 'Commandepar' in ordered_details.columns else '',
+        ORDDAT=reformat_date(order_details['Datecommande'].iloc[0]) if 'Datecommande' in order_details.columns else '',
+        CUSORDREF=order_details['Nocommande'].iloc[0] if 'Nocommande' in order_details.columns else '',
+        EXPDATE=reformat_date(delivery_details['Datedelivraisonsouhaitee'].iloc[0]) if 'Datedelivraisonsouhaitee' in delivery_details.columns else '',
+    )
+
+
+def build_lines(products_details, first_line=1):
+    # Build the L lines from the product columns; returns (lines, rejected lines)
+    lines = order_lines(products_details['Article'], products_details['Quanten\nUC'])
+    return normalize_lines(lines, products_details.get('EAN'), first_line)
+
+
+def generate_erp_sage_csv(ordered_details, order_details, delivery_details, products_details, erp_sage_csv_path):
+    if not check_tables(ordered_details, order_details, delivery_details, products_details):
+        return None
+    header = build_header(ordered_details, order_details, delivery_details)
+    lines, rejects = build_lines(products_details)
+    write_rejects(erp_sage_csv_path, header, rejects)
+    check_lines_left(len(lines))
+    return write_order(erp_sage_csv_path, header, lines)
+
+
+def products_top(page):
+    # Fraction of the page height where the product table starts: the rule above
+    # its header row (an "Article" cell on the line of a "Libelle..." cell), None
+    # when the row is not on the page. Scans the characters in content order
+    # instead of grouping them into words, which would cost a second layout pass.
+    chars = page.chars
+    text = ''.join(char['text'] for char in chars)
+    header_tops = {round(chars[match.start()]['top']) for match in re.finditer('Libelle', text)}
+    for match in re.finditer('Article', text):
+        top = chars[match.start()]['top']
+        if round(top) in header_tops:
+            border = max((rule['top'] for rule in page.lines + page.rects if rule['top'] <= top), default=top)
+            return max(border - SPLIT_MARGIN, 0) / float(page.height)
+    return None
+
+
+def page_regions(page, bboxes):
+    # The template's regions of a page with the header/body boundary moved to the
+    # top of the product table's header row, when it is found
+    split = products_top(page)
+    if split is None:
+        return bboxes
+    header_bottom = TEMPLATE['header']['bbox'][3]
+    body_tops = {region['bbox'][1] for region in TEMPLATE['body']}
+    regions = []
+    for x0, top, x1, bottom in bboxes:
+        regions.append((x0, split if top in body_tops else top, x1, split if bottom == header_bottom else bottom))
+    return regions
+
+
+def classify_tables(tables):
+    # (table name, header, rows) of the known tables among pdfplumber's tables
+    found = []
+    for table in tables:
+        if table:  # Check if the table is not empty
+            headers = tuple(table[0])  # Convert headers to tuple for easy lookup
+            table_name = header_to_name.get(headers, None)
+            if table_name:
+                found.append((table_name, table[0], table[1:]))
+    return found
+
+
+def iter_page_tables(pdf_path, page_numbers=None):
+    # Yield the known tables of each requested page (all pages by default) as a
+    # list of (table name, header, rows). Pages are parsed one at a time and their
+    # objects released before the next one, so memory does not grow with the page count.
+
+    # Open the PDF file
+    with metrics.timer('pdf_open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        areas = page_areas(TEMPLATE, len(pdf.pages))
+
+        # Iterate over the requested pages of the PDF
+        for number in page_numbers or range(1, len(pdf.pages) + 1):
+            page = pdf.pages[number - 1]
+
+            # Extract tables from the template regions of the page only
+            with metrics.timer('table_extraction'):
+                regions = page_regions(page, areas.get(number, []))
+                tables = [table for bbox in regions for table in crop(page, bbox).extract_tables()]
+            with metrics.timer('classification'):
+                found = classify_tables(tables)
+
+            # A layout the regions do not fit: read the whole first page instead
+            if number == 1 and not FIRST_PAGE_TABLES <= {table_name for table_name, _, rows in found if rows}:
+                logger.warning("Order tables not found in the page 1 regions of %s, reading the whole page", pdf_path)
+                metrics.count('layout_fallbacks')
+                with metrics.timer('table_extraction'):
+                    tables = page.extract_tables()
+                with metrics.timer('classification'):
+                    found = classify_tables(tables)
+
+            # Release the page's parsed objects before moving on
+            page.close()
+            metrics.count('pages')
+            metrics.count('tables', len(tables))
+            yield found
+
+
+def classify_pages(pdf_path, page_numbers=None):
+    # Known tables on the given pages as one list per page. Only reads the PDF,
+    # so it can run in a worker process on a share of the pages.
+    return list(iter_page_tables(pdf_path, page_numbers))
+
+
+def add_page_tables(accumulator, found):
+    for table_name, header, rows in found:
+        if table_name in ('products details', 'ordered details'):
+            # Combine the tables spread over several pages into one table, in page and line order
+            accumulator.add_rows(table_name, header, rows)
+        else:
+            logger.debug("Table type: %s", table_name)
+
+            # Keep the last order or delivery table found
+            accumulator.add_rows(table_name, header, rows, replace=True)
+
+
+def extract_tables(pdf_path, page_workers=1):
+    # With page_workers > 1, long orders have their pages split across that many
+    # processes; pages are merged back in order, so the tables are the same.
+    if page_workers > 1:
+        with pdfplumber.open(pdf_path) as pdf:
+            page_count = len(pdf.pages)
+        pages = map_pages(classify_pages, pdf_path, page_count, page_workers)
+    else:
+        pages = classify_pages(pdf_path)
+
+    # Collect the rows of every table type and build each DataFrame once at the end
+    with metrics.timer('classification'):
+        accumulator = TableAccumulator(dtypes=table_dtypes)
+        for found in pages:
+            add_page_tables(accumulator, found)
+        return accumulator.build()
+
+
+def order_reference(tables):
+    # PO number of the extracted order (CUSORDREF), None when it was not found
+    order_details = tables.get('order details')
+    if order_details is None or order_details.empty or 'Nocommande' not in order_details.columns:
+        return None
+    reference = order_details['Nocommande'].iloc[0]
+    return None if pd.isna(reference) else str(reference).strip() or None
+
+
+def resolve_orderer(df_ordered, reference_cache):
+    # Replace 'Commandepar' column in 'ordered details' with closest match UID
+    if 'Commandepar' in df_ordered.columns:
+        client_index = reference_cache.client_index()
+        present = df_ordered['Commandepar'].notnull()
+        matches = client_index.match_many(df_ordered.loc[present, 'Commandepar'])
+        df_ordered.loc[present, 'Commandepar'] = [uid for _, uid, _ in matches]
+
+
+def export_order(tables, output_file, reference_cache=None, debug_dir=None):
+    reference_cache = reference_cache or get_reference_cache()
+
+    # Modify 'Article' column in 'products details' tables
+    if 'products details' in tables:
+        modify_article_column(tables['products details'], reference_cache.product_resolver())
+
+    # Replace 'Commandepar' column in 'ordered details' with closest match UID
+    if 'ordered details' in tables:
+        resolve_orderer(tables['ordered details'], reference_cache)
+
+    # Keep a copy of the classified tables only when asked to
+    if debug_dir:
+        save_debug_tables(tables, debug_dir, output_file)
+
+    # Generate ERP Sage CSV straight from the in-memory tables
+    return generate_erp_sage_csv(
+        tables.get('ordered details', None),
+        tables.get('order details', None),
+        tables.get('delivery details', None),
+        tables.get('products details', None),
+        output_file
+    )
+
+
+def process_order(pdf_path, output_file, reference_cache=None, debug_dir=None, page_workers=1):
+    return export_order(extract_tables(pdf_path, page_workers), output_file, reference_cache, debug_dir)
+
+
+def stream_order(pdf_path, output_file, reference_cache=None, chunk_rows=STREAM_CHUNK_ROWS, trace_memory=False):
+    # Memory-bounded process_order() for very long orders: pages are read one at a
+    # time, and product rows are resolved and turned into Sage lines chunk_rows at a
+    # time. The E line needs the delivery table of the last page, so the L lines wait
+    # in a spool (memory, then a temporary file) until the whole PDF was read.
+    # Writes the same file as process_order() and prints the peak memory.
+    reference_cache = reference_cache or get_reference_cache()
+    resolver = reference_cache.product_resolver()
+    header_tables = TableAccumulator(dtypes=table_dtypes)
+    products_header = None
+    pending = []
+    rejects = []
+    next_line = 1
+
+    def spool_rows(spool, rows):
+        nonlocal next_line
+        chunk = TableAccumulator(dtypes=table_dtypes)
+        chunk.add_rows('products details', products_header, rows)
+        products = chunk.build()['products details']
+        modify_article_column(products, resolver)
+        lines, rejected = build_lines(products, next_line)
+        spool.add(lines)
+        rejects.append(rejected)
+        next_line += len(products)
+
+    with MemoryTracker(trace_memory) as memory, LineSpool() as spool:
+        for found in iter_page_tables(pdf_path):
+            for table_name, header, rows in found:
+                if table_name == 'products details':
+                    products_header = products_header or header
+                    pending.extend(rows)
+                else:
+                    add_page_tables(header_tables, [(table_name, header, rows)])
+            while len(pending) >= chunk_rows:
+                spool_rows(spool, pending[:chunk_rows])
+                del pending[:chunk_rows]
+        if pending:
+            spool_rows(spool, pending)
+
+        tables = header_tables.build()
+        if 'ordered details' in tables:
+            resolve_orderer(tables['ordered details'], reference_cache)
+        ordered_details = tables.get('ordered details', None)
+        order_details = tables.get('order details', None)
+        delivery_details = tables.get('delivery details', None)
+        products_details = spool if products_header else None
+        written = None
+        if check_tables(ordered_details, order_details, delivery_details, products_details):
+            header = build_header(ordered_details, order_details, delivery_details)
+            write_rejects(output_file, header, pd.concat(rejects, ignore_index=True))
+            check_lines_left(spool.lines)
+            written = spool.write_order(output_file, header)
+
+    logger.info("Peak memory: %s", memory.report())
+    if metrics.current() is not None:
+        metrics.current().fields.update(peak_rss=memory.rss, peak_traced=memory.peak)
+    return written
@@ -0,0 +1,330 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+import pandas as pd
+
+from finalities.batch import (export_extracted, extract_in_worker, journal_prepass, output_paths, record_bundled,
+                              summarize)
+from finalities.bundle import DEFAULT_MAX_BYTES as DEFAULT_BUNDLE_BYTES, BundleOrder, SageBundle
+from finalities.extract_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from finalities.normalize import REJECT_FIELDS, rejects_path, save_rejects
+from finalities.parsers import get_parser
+from finalities.refcache import get_reference_cache
+from finalities.sage import atomic_open
+
+# Orders allowed to wait between two stages: extraction stops submitting PDFs
+# while this many extracted orders wait to be resolved, and resolution waits
+# while this many resolved orders wait to be written
+QUEUE_SIZE = 8
+
+# End of the stream, one per consumer thread
+DONE = None
+
+
+class Stage:
+    # Time one stage of the pipeline spent working, waiting for input (starved)
+    # and waiting for room downstream (blocked); utilization is the working share
+    # of the wall time of its lanes (worker processes or threads).
+
+    def __init__(self, name, lanes=1):
+        self.name = name
+        self.lanes = lanes
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.peak_queue = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timing(self, state):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(state, time.perf_counter() - start)
+
+    def add(self, state, seconds):
+        with self.lock:
+            setattr(self, state, getattr(self, state) + seconds)
+
+    def waiting(self, size):
+        # Record the depth of the stage's input queue when it takes an item
+        with self.lock:
+            self.peak_queue = max(self.peak_queue, size)
+
+    def as_dict(self, elapsed):
+        return {
+            'lanes': self.lanes,
+            'items': self.items,
+            'busy_seconds': round(self.busy, 3),
+            'starved_seconds': round(self.starved, 3),
+            'blocked_seconds': round(self.blocked, 3),
+            'peak_queue': self.peak_queue,
+            'utilization': round(self.busy / (elapsed * self.lanes), 3) if elapsed else 0.0,
+        }
+
+
+class DeferredOrder:
+    # Stands in for the SageBundle given to export_extracted(): the parser exports
+    # the order into memory (a BundleOrder) and the write stage writes it later.
+    # export_extracted() asks it whether the PO is pending before exporting; a PO
+    # that is not gets reserved for this order, so two resolve threads never
+    # export the same PO. The write stage releases the reservation once the order
+    # is written (and journaled) or has failed.
+
+    def __init__(self, pipeline, pdf_path, output):
+        self.pipeline = pipeline
+        self.pdf_path = pdf_path
+        self.output = output
+        self.target = None
+        self.info = None
+        self.reserved = None
+
+    @contextmanager
+    def order(self, name, **info):
+        target = BundleOrder(name)
+        target.path = '' if self.pipeline.bundle is not None else os.path.join(self.pipeline.output_dir, name)
+        self.target = target
+        yield target
+        self.info = info
+
+    def pending_order(self, retailer, order_ref):
+        info = self.pipeline.reserve(retailer, order_ref, {
+            'file': self.pdf_path, 'retailer': retailer, 'order_ref': order_ref,
+            'output': '' if self.pipeline.bundle is not None else self.output})
+        if info is None and order_ref:
+            self.reserved = (retailer, order_ref)
+        return info
+
+
+class Pipeline:
+    # Batch conversion in three overlapping stages joined by bounded queues:
+    #   extract  worker processes read the PDFs (extract_in_worker)
+    #   resolve  threads here resolve EANs and stores and build each order's
+    #            records in memory (export_extracted)
+    #   write    this thread writes each order's Sage file and reject report, or
+    #            adds it to the SageBundle, and journals it
+    # so the tables of order N+1 are extracted while order N is resolved and
+    # order N-1 written. Extraction only takes a PDF while fewer than queue_size
+    # extracted orders wait for resolution, so a slow database holds the workers
+    # back instead of filling memory with tables.
+
+    def __init__(self, retailer, output_dir, workers=None, reference_cache=None, debug_dir=None,
+                 cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES, profile_dir=None, profiler='cprofile',
+                 journal=None, bundle=None, queue_size=QUEUE_SIZE, resolve_threads=1):
+        self.retailer = retailer
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.reference_cache = reference_cache or get_reference_cache()
+        self.debug_dir = debug_dir
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self.journal = journal
+        self.bundle = bundle
+        self.resolve_threads = resolve_threads
+        # PDFs being extracted or waiting for resolution: one per worker plus the queue
+        self.slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self.extracted = queue.Queue()  # bounded by the slots
+        self.resolved = queue.Queue(maxsize=queue_size)
+        self.held = {}  # (retailer, PO number) -> info of the orders being resolved or waiting to be written
+        self.held_lock = threading.Lock()
+        self.outputs = {}
+        self.remaining = 0
+        self.remaining_lock = threading.Lock()
+        self.elapsed = 0.0
+        self.stages = {'extract': Stage('extract', self.workers), 'resolve': Stage('resolve', resolve_threads),
+                       'write': Stage('write')}
+
+    def reserve(self, retailer, order_ref, info):
+        # Info of the order already holding this PO (resolved but not written yet,
+        # or in the current bundle file); None after reserving it with info
+        with self.held_lock:
+            held = self.held.get((retailer, order_ref)) if order_ref else None
+            if held is None and self.bundle is not None:
+                held = self.bundle.pending_order(retailer, order_ref)
+            if held is None and order_ref:
+                self.held[(retailer, order_ref)] = info
+        return held
+
+    def release(self, deferred):
+        if deferred.reserved is not None:
+            with self.held_lock:
+                self.held.pop(deferred.reserved, None)
+
+    def _extracted(self, pdf_path, future):
+        # Done callback of a worker's future, in the executor's thread
+        self.extracted.put((pdf_path, future))
+        with self.remaining_lock:
+            self.remaining -= 1
+            if self.remaining == 0:
+                for _ in range(self.resolve_threads):
+                    self.extracted.put(DONE)
+
+    def _feed(self, pool, pdf_paths):
+        stage = self.stages['extract']
+        for pdf_path in pdf_paths:
+            with stage.timing('blocked'):
+                self.slots.acquire()
+            try:
+                future = pool.submit(extract_in_worker, self.retailer, pdf_path, self.cache_dir, self.cache_max_bytes,
+                                     self.profile_dir, self.profiler)
+            except Exception as error:
+                # Broken pool: the resolve stage reports the order as failed
+                future = Future()
+                future.set_exception(error)
+            future.add_done_callback(partial(self._extracted, pdf_path))
+
+    def _resolve(self, hashes):
+        stage = self.stages['resolve']
+        try:
+            while True:
+                stage.waiting(self.extracted.qsize())
+                with stage.timing('starved'):
+                    item = self.extracted.get()
+                if item is DONE:
+                    break
+                self.slots.release()
+                pdf_path, future = item
+                deferred = DeferredOrder(self, pdf_path, self.outputs.get(pdf_path))
+                with stage.timing('busy'):
+                    try:
+                        entry = self._export(future, pdf_path, hashes, deferred)
+                    except Exception:
+                        # Outside export_extracted's own handling, e.g. the journal
+                        # failing: report the order as failed and carry on, so the
+                        # extracted queue keeps draining and the feeder its slots
+                        error = traceback.format_exc()
+                        entry = {'file': pdf_path, 'retailer': self.retailer or '', 'order_ref': '', 'status': 'failed',
+                                 'output': '', 'rejected': 0, 'cached': False, 'extract_seconds': 0.0,
+                                 'export_seconds': 0.0, 'error': error.strip().splitlines()[-1], 'traceback': error}
+                        deferred.target = None
+                    stage.items += 1
+                with stage.timing('blocked'):
+                    self.resolved.put((entry, deferred))
+        finally:
+            # Even when this thread fails, so the write stage does not wait for it forever
+            self.resolved.put(DONE)
+
+    def _export(self, future, pdf_path, hashes, deferred):
+        try:
+            result = future.result()
+        except Exception:
+            # The worker process died; report the order as failed
+            result = {'retailer': self.retailer, 'tables': None, 'order_ref': None, 'cached': False,
+                      'error': traceback.format_exc(), 'seconds': 0.0, 'metrics': {}}
+        self.stages['extract'].add('busy', result['seconds'])
+        return export_extracted(result, pdf_path, self.output_dir, self.reference_cache, self.debug_dir,
+                                self.profile_dir, self.profiler, self.journal, hashes.get(pdf_path), deferred,
+                                deferred.output)
+
+    def _write(self, entry, target, info):
+        try:
+            if self.bundle is not None:
+                # Journaled by the bundle's on_flush once its file is written
+                self.bundle.add(target, **info)
+            else:
+                with atomic_open(target.path) as file:
+                    file.write(target.buffer.getvalue())
+                rejects = pd.concat(target.rejects, ignore_index=True) if target.rejects else pd.DataFrame(columns=REJECT_FIELDS)
+                save_rejects(rejects_path(target.path), rejects)
+            entry['output'] = target.path
+        except Exception:
+            error = traceback.format_exc()
+            entry.update(status='failed', output='', error=error.strip().splitlines()[-1], traceback=error)
+        if self.journal is not None and info['file_hash'] and (self.bundle is None or entry['status'] != 'ok'):
+            self.journal.record(info['file_hash'], info['file'], entry['status'], entry['retailer'], entry['order_ref'],
+                                entry['output'], entry['error'])
+
+    def _write_rejects(self, target):
+        # Reject report of an order whose export failed (every line rejected), as
+        # run_batch() leaves it; a bundle drops failed orders with their rejects
+        if self.bundle is None and target.rejects:
+            save_rejects(rejects_path(target.path), pd.concat(target.rejects, ignore_index=True))
+
+    def run(self, pdf_paths, hashes=None):
+        # Convert pdf_paths and return their report entries, in the order they were written
+        stage = self.stages['write']
+        report = []
+        start = time.perf_counter()
+        self.outputs = output_paths(pdf_paths, self.output_dir)
+        self.remaining = len(pdf_paths)
+        if not pdf_paths:
+            for _ in range(self.resolve_threads):
+                self.extracted.put(DONE)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            feeder = threading.Thread(target=self._feed, args=(pool, pdf_paths), daemon=True)
+            resolvers = [threading.Thread(target=self._resolve, args=(hashes or {},), daemon=True)
+                         for _ in range(self.resolve_threads)]
+            feeder.start()
+            # Warm the cache while the workers extract
+            self.reference_cache.products()
+            self.reference_cache.client_index()
+            for thread in resolvers:
+                thread.start()
+            finished = 0
+            while finished < self.resolve_threads:
+                stage.waiting(self.resolved.qsize())
+                with stage.timing('starved'):
+                    item = self.resolved.get()
+                if item is DONE:
+                    finished += 1
+                    continue
+                entry, deferred = item
+                try:
+                    if entry['status'] == 'ok':
+                        with stage.timing('busy'):
+                            self._write(entry, deferred.target, deferred.info)
+                        stage.items += 1
+                    elif deferred.target is not None:
+                        with stage.timing('busy'):
+                            self._write_rejects(deferred.target)
+                finally:
+                    self.release(deferred)
+                report.append(entry)
+            feeder.join()
+        self.stages['extract'].items = len(pdf_paths)
+        self.elapsed = time.perf_counter() - start
+        return report
+
+    def utilization(self):
+        return {name: stage.as_dict(self.elapsed) for name, stage in self.stages.items()}
+
+
+def run_pipeline(pdf_paths, retailer, output_dir, workers=None, reference_cache=None, debug_dir=None,
+                 cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES, profile_dir=None, profiler='cprofile',
+                 journal=None, bundle_orders=None, bundle_max_bytes=DEFAULT_BUNDLE_BYTES, queue_size=QUEUE_SIZE,
+                 resolve_threads=1):
+    # run_batch() with extraction, resolution and writing overlapped (see Pipeline).
+    # Returns the same report and summary, the summary with the utilization of
+    # each stage under 'stages'.
+    if retailer:
+        get_parser(retailer)
+    os.makedirs(output_dir, exist_ok=True)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    report, pdf_paths, hashes = journal_prepass(journal, pdf_paths, retailer)
+    bundle = None
+    if bundle_orders:
+        bundle = SageBundle(output_dir, max_orders=bundle_orders, max_bytes=bundle_max_bytes,
+                            on_flush=partial(record_bundled, journal))
+
+    pipeline = Pipeline(retailer, output_dir, workers, reference_cache, debug_dir, cache_dir, cache_max_bytes,
+                        profile_dir, profiler, journal, bundle, queue_size, resolve_threads)
+    with bundle or nullcontext():
+        report.extend(pipeline.run(pdf_paths, hashes))
+
+    summary = summarize(report, pipeline.workers, bundle, time.perf_counter() - start,
+                        pipeline.reference_cache.pool_stats())
+    summary['stages'] = pipeline.utilization()
+    return report, summary
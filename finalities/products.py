@@ -0,0 +1,79 @@
+import pandas as pd
+
+from finalities import metrics
+
+# Maximum number of EANs sent in one "WHERE EAN IN (...)" query
+EAN_CHUNK_SIZE = 500
+
+
+def normalize_ean(value):
+    # Bring an EAN to its canonical string form; tabula gives ints or floats
+    # (6111175000741.0), pdfplumber gives strings that may carry whitespace
+    if value is None or value is pd.NA:
+        return None
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return None
+        if value.is_integer():
+            value = int(value)
+    text = str(value).strip()
+    if text.endswith('.0') and text[:-2].isdigit():
+        text = text[:-2]
+    return text or None
+
+
+class ProductResolver:
+    # Resolves EANs to product UIDs and keeps the results, so that a batch of
+    # orders only ever asks once per EAN. The products come from, in order:
+    #   table  the EAN map of a memory-mapped snapshot (finalities.snapshot.ProductTable),
+    #          in which the EANs of each order are looked up and kept in uids
+    #   query  a function running SQL with arguments and returning DictCursor rows,
+    #          through which only the order's EANs are fetched with chunked IN queries
+    #   uids   alone, the whole products table preloaded by finalities.refcache
+
+    def __init__(self, query=None, chunk_size=EAN_CHUNK_SIZE, uids=None, table=None):
+        self.query = query
+        self.chunk_size = chunk_size
+        self.uids = {} if uids is None else uids
+        self.table = table
+        self.misses = set()
+
+    def resolve(self, eans):
+        # Look up every EAN that has not been seen yet and return the EAN -> UID map
+        if self.query is None and self.table is None:
+            return self.uids
+        pending = sorted({normalize_ean(ean) for ean in eans} - {None} - self.uids.keys() - self.misses)
+        if self.table is not None:
+            self.uids.update(self.table.lookup(pending))
+            self.misses.update(ean for ean in pending if ean not in self.uids)
+            return self.uids
+        for start in range(0, len(pending), self.chunk_size):
+            chunk = pending[start:start + self.chunk_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            rows = self.query(f"SELECT EAN, UID FROM products WHERE EAN IN ({placeholders})", chunk)
+            for row in rows:
+                self.uids[normalize_ean(row['EAN'])] = row['UID']
+            self.misses.update(ean for ean in chunk if ean not in self.uids)
+        return self.uids
+
+    def map_column(self, table_df, column, keep_unmatched=True, source_column=None):
+        # Replace the EANs of a DataFrame column with their UIDs in place.
+        # Unknown EANs keep their original value unless keep_unmatched is False,
+        # in which case they become None. With source_column, the original EANs
+        # are kept in that column.
+        if column not in table_df.columns:
+            raise ValueError(f"Column '{column}' not found in DataFrame.")
+        with metrics.timer('ean_resolve'):
+            self.resolve(table_df[column])
+            uids = table_df[column].map(normalize_ean).map(self.uids)
+        metrics.count('eans', len(uids))
+        metrics.count('eans_unmatched', int(uids.isna().sum()))
+        if keep_unmatched:
+            uids = uids.where(uids.notna(), table_df[column])
+        else:
+            uids = uids.astype(object).where(uids.notna(), None)
+        if source_column:
+            table_df[source_column] = table_df[column]
+        table_df[column] = uids
+        return table_df
+
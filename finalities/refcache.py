@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+
+from finalities import metrics
+from finalities.db import get_pool
+from finalities.matchmemo import DEFAULT_MEMO, MatchMemo
+from finalities.products import ProductResolver, normalize_ean
+from finalities.snapshot import DEFAULT_SNAPSHOT, open_snapshot
+from finalities.stores import ClientIndex, prepare_clients
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a cached table is checked against the database again
+REFERENCE_TTL = 300
+
+# Cheap queries telling whether a table changed since it was loaded
+VERSION_SQL = {
+    'clients': "SELECT COUNT(*) AS row_count, MAX(UID) AS max_uid FROM clients",
+    'products': "SELECT COUNT(*) AS row_count, MAX(EAN) AS max_ean FROM products",
+}
+
+
+class ReferenceCache:
+    # In-process cache of the reference tables used to resolve orders:
+    #   clients  -> parallel uids/dens lists plus the prebuilt ClientIndex
+    #   products -> a plain {EAN: UID} dict
+    # Each table is loaded once. After `ttl` seconds the next access runs the
+    # table's version query (row count and max key) and reloads only if it changed,
+    # so a long-running process makes no reference queries per order. A MatchMemo,
+    # when given, is shared by the client indexes to skip fuzzy scoring of stores
+    # already matched.
+    #
+    # With a Snapshot (finalities.snapshot), a table whose database version still
+    # matches the snapshot's is read from the memory-mapped file instead of being
+    # queried, and when the database cannot be reached the tables are resolved
+    # offline from the snapshot (or kept as already loaded).
+
+    def __init__(self, pool=None, ttl=REFERENCE_TTL, clock=time.monotonic, memo=None, snapshot=None):
+        self.pool = pool
+        self.memo = memo
+        self.snapshot = snapshot
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.client_uids = []
+        self.client_dens = []
+        self.client_prepared = None
+        self.product_uids = {}
+        self.product_table = None
+        self.versions = {}
+        self.checked_at = {}
+        self.client_indexes = {}
+        self.loads = {'clients': 0, 'products': 0}
+        self.version_checks = 0
+
+    def _query(self, sql, args=None):
+        metrics.count('db_queries')
+        with metrics.timer('db_query'), (self.pool or get_pool()).cursor() as cursor:
+            cursor.execute(sql, args)
+            return cursor.fetchall()
+
+    def _version(self, table):
+        self.version_checks += 1
+        row = self._query(VERSION_SQL[table])[0]
+        return tuple(str(value) for value in row.values())
+
+    def pool_stats(self):
+        # ConnectionPool.stats() of the pool the reference queries go through
+        return (self.pool or get_pool()).stats()
+
+    def live_versions(self):
+        return {table: self._version(table) for table in VERSION_SQL}
+
+    def _from_snapshot(self, table, version):
+        if self.snapshot is None:
+            return False
+        if self.snapshot.versions.get(table) == version:
+            return True
+        logger.warning("Reference snapshot %s is older than the %s table, loading it from the database; "
+                       "run 'finalities snapshot export'", self.snapshot.path, table)
+        return False
+
+    def _load_clients(self, version):
+        if self._from_snapshot('clients', version):
+            self.client_prepared = self.snapshot.prepared_clients()
+            self.client_dens, self.client_uids = self.client_prepared[:2]
+        else:
+            rows = self._query("SELECT UID, Den FROM clients")
+            self.client_uids = [row['UID'] for row in rows]
+            self.client_dens = [row['Den'] for row in rows]
+            self.client_prepared = None
+        self.client_indexes = {}
+
+    def _load_products(self, version):
+        if self._from_snapshot('products', version):
+            self.product_table = self.snapshot.products
+            self.product_uids = {}
+        else:
+            rows = self._query("SELECT EAN, UID FROM products")
+            self.product_uids = {normalize_ean(row['EAN']): row['UID'] for row in rows}
+            self.product_table = None
+
+    def _ensure(self, table):
+        # Load the table on first use, re-check its version once the TTL expired
+        with self.lock:
+            now = self.clock()
+            if table in self.checked_at and now - self.checked_at[table] < self.ttl:
+                return
+            try:
+                version = self._version(table)
+            except Exception:
+                if self.snapshot is None:
+                    raise
+                # Offline: keep the table as loaded, or read it from the snapshot
+                logger.debug("Version query of %s failed", table, exc_info=True)
+                if table in self.versions:
+                    logger.warning("Database unavailable, keeping the %s table as loaded", table)
+                    version = self.versions[table]
+                else:
+                    logger.warning("Database unavailable, resolving %s offline from the snapshot of %s",
+                                   table, self.snapshot.created)
+                    version = self.snapshot.versions[table]
+            if self.versions.get(table) != version:
+                if table == 'clients':
+                    self._load_clients(version)
+                else:
+                    self._load_products(version)
+                self.loads[table] += 1
+                self.versions[table] = version
+            self.checked_at[table] = now
+
+    def invalidate(self, table=None):
+        # Force the next access to check the table (or every table) again
+        with self.lock:
+            for name in ([table] if table else list(VERSION_SQL)):
+                self.checked_at.pop(name, None)
+                self.versions.pop(name, None)
+
+    def client_entries(self):
+        # Rows shaped like the old DictCursor result of "SELECT UID, Den FROM clients"
+        self._ensure('clients')
+        return [{'UID': uid, 'Den': den} for uid, den in zip(self.client_uids, self.client_dens)]
+
+    def prepared_clients(self):
+        # Clients split and normalized once for every ClientIndex (stores.prepare_clients)
+        self._ensure('clients')
+        with self.lock:
+            if self.client_prepared is None:
+                self.client_prepared = prepare_clients(self.client_entries())
+            return self.client_prepared
+
+    def client_index(self, noise_words=()):
+        prepared = self.prepared_clients()
+        with self.lock:
+            key = tuple(noise_words)
+            if key not in self.client_indexes:
+                self.client_indexes[key] = ClientIndex((), noise_words=key, memo=self.memo, prepared=prepared)
+            return self.client_indexes[key]
+
+    def products(self):
+        # The {EAN: UID} dict, or the snapshot's ProductTable when the products
+        # table was read from the snapshot
+        self._ensure('products')
+        return self.product_table if self.product_table is not None else self.product_uids
+
+    def product_resolver(self):
+        # A resolver answering from the cached products map or the snapshot,
+        # without any query. Until the products table was loaded (batch runs and
+        # the daemon warm it with products()), and without a snapshot, a one-shot
+        # conversion fetches only its own EANs with chunked IN queries instead of
+        # loading the whole table.
+        with self.lock:
+            cold = 'products' not in self.versions
+        if cold and self.snapshot is None:
+            return ProductResolver(query=self._query)
+        products = self.products()
+        if isinstance(products, dict):
+            return ProductResolver(uids=products)
+        return ProductResolver(table=products)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_reference_cache(**options):
+    # Process-wide reference cache shared by every parser, with the persistent
+    # match memo and the exported snapshot (if there is one) unless memo or
+    # snapshot is given (None disables it)
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if 'memo' not in options:
+                options['memo'] = MatchMemo(DEFAULT_MEMO)
+            if 'snapshot' not in options:
+                options['snapshot'] = open_snapshot(DEFAULT_SNAPSHOT)
+            _cache = ReferenceCache(**options)
+        return _cache
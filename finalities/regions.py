@@ -0,0 +1,78 @@
+import re
+
+# Extraction templates tell where each part of a purchase order sits. A region is a
+# page selection ('first', 'last', 'rest', 'all' or a list of 1-based page numbers,
+# negative ones counting from the end) and a bounding box (x0, top, x1, bottom) in
+# fractions of the page, so the same template fits every page size. A template maps
+# a part name to one region or to a list of regions.
+
+
+def _regions(entry):
+    return entry if isinstance(entry, list) else [entry]
+
+
+def page_numbers(pages, page_count):
+    # 1-based page numbers selected by a region, within the document
+    if pages == 'first':
+        return [1] if page_count else []
+    if pages == 'last':
+        return [page_count] if page_count else []
+    if pages == 'rest':
+        return list(range(2, page_count + 1))
+    if pages == 'all':
+        return list(range(1, page_count + 1))
+    numbers = [number + page_count + 1 if number < 0 else number for number in pages]
+    return [number for number in numbers if 1 <= number <= page_count]
+
+
+def page_areas(template, page_count):
+    # Page number -> bounding boxes to read on that page, in template order
+    areas = {}
+    for entry in template.values():
+        for region in _regions(entry):
+            for number in page_numbers(region['pages'], page_count):
+                areas.setdefault(number, []).append(region['bbox'])
+    return areas
+
+
+def crop(page, bbox):
+    # pdfplumber page restricted to a fractional bounding box
+    x0, top, x1, bottom = bbox
+    return page.crop((x0 * float(page.width), top * float(page.height),
+                      x1 * float(page.width), bottom * float(page.height)))
+
+
+def search_fields(text, patterns):
+    # Field name -> first capture group of its pattern; fields not found are left out
+    fields = {}
+    for key, pattern in patterns.items():
+        match = re.search(pattern, text)
+        if match:
+            fields[key] = match.group(1).strip()
+    return fields
+
+
+def tabula_options(entry, page_count=None):
+    # read_pdf() options restricting tabula to a region, or to several regions on the
+    # same pages read in one pass (one table per region, in template order). Areas
+    # are explicit so tabula's table guessing is skipped. Only 'first' and 'all'
+    # can be given to tabula without knowing the page count. A selection matching
+    # no page of the document raises: tabula would take an empty page list as no
+    # selection and read page 1.
+    regions = _regions(entry)
+    pages = regions[0]['pages']
+    if any(region['pages'] != pages for region in regions):
+        raise ValueError("Regions read in one tabula pass must select the same pages")
+    if pages == 'first':
+        pages = 1
+    elif pages != 'all':
+        pages = page_numbers(pages, page_count)
+        if not pages:
+            raise ValueError(f"Region pages {regions[0]['pages']!r} select no page of a {page_count}-page document")
+    areas = [[top * 100, x0 * 100, bottom * 100, x1 * 100] for x0, top, x1, bottom in (region['bbox'] for region in regions)]
+    return {
+        'pages': pages,
+        'area': areas if len(areas) > 1 else areas[0],
+        'relative_area': True,
+        'guess': False,
+    }
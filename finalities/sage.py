@@ -0,0 +1,164 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from finalities import metrics
+
+# Record layout of the Sage X3 sales-order import file, shared by every retailer.
+# One E (header) record per order followed by its L (line) records, ';'-separated.
+E_FIELDS = ('E', 'SALFCY', 'SOHTYP', 'SOHNUM', 'BPCORD', 'ORDDAT', 'CUSORDREF', 'STOFCY', 'EXPDATE', 'ADR')
+L_FIELDS = ('L', 'ITMREF', 'ITMDES', 'SAU', 'QTY', 'L6', 'L7', 'L8', 'L9', 'L10')
+
+# Values every order header gets unless the parser sets them
+E_DEFAULTS = {
+    'SALFCY': 'AL1',
+    'SOHTYP': 'SON',
+    'SOHNUM': '',
+    'STOFCY': 'AL1',  # Set STOFCY same as SALFCY
+    'ADR': 'ADR',
+}
+
+# Sales unit written when the purchase order does not give one
+DEFAULT_SAU = 'CAR'
+
+# Rows handed to the CSV writer at a time
+WRITE_CHUNK_SIZE = 10000
+
+# Bytes of L records a LineSpool keeps in memory before moving them to a temporary file
+SPOOL_MEMORY = 8 * 1024 * 1024
+
+WRITE_BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE * 64
+
+DATE_FIELDS = ('ORDDAT', 'EXPDATE')
+_date_pattern = re.compile(r'^\d{8}$')
+
+
+class SageSchemaError(ValueError):
+    pass
+
+
+def _text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    return str(value)
+
+
+def order_header(**fields):
+    # Build and check the E record of an order; unknown fields are rejected
+    unknown = set(fields) - set(E_FIELDS[1:])
+    if unknown:
+        raise SageSchemaError(f"Unknown E fields: {', '.join(sorted(unknown))}")
+    header = dict(E_DEFAULTS, **fields)
+    record = ['E'] + [_text(header.get(field)) for field in E_FIELDS[1:]]
+    for field, value in zip(E_FIELDS, record):
+        if ';' in value or '\n' in value:
+            raise SageSchemaError(f"E field {field} contains a separator: {value!r}")
+        if field in DATE_FIELDS and value and not _date_pattern.match(value):
+            raise SageSchemaError(f"E field {field} is not a YYYYMMDD date: {value!r}")
+    return record
+
+
+def order_lines(itmref, qty, sau=DEFAULT_SAU):
+    # Build the L records of an order with column operations. itmref and qty are
+    # Series (or arrays) of the same length, sau a Series or a single value.
+    itmref = pd.Series(itmref).reset_index(drop=True)
+    qty = pd.Series(qty).reset_index(drop=True)
+    if len(itmref) != len(qty):
+        raise SageSchemaError(f"{len(itmref)} item references for {len(qty)} quantities")
+    lines = pd.DataFrame({field: '' for field in L_FIELDS}, index=itmref.index)
+    lines['L'] = 'L'
+    lines['ITMREF'] = itmref.astype(object).where(itmref.notna(), '')
+    lines['SAU'] = sau.reset_index(drop=True) if isinstance(sau, pd.Series) else sau
+    lines['QTY'] = qty.astype(object).where(qty.notna(), '')
+    return lines[list(L_FIELDS)]
+
+
+def _check_lines(lines):
+    if tuple(lines.columns) != L_FIELDS:
+        raise SageSchemaError(f"L records must have the columns {L_FIELDS}, got {tuple(lines.columns)}")
+
+
+def _write_lines(file, lines):
+    _check_lines(lines)
+    lines.to_csv(file, sep=';', header=False, index=False, lineterminator='\n', chunksize=WRITE_CHUNK_SIZE)
+    metrics.count('lines_written', len(lines))
+
+
+def write_records(file, header, lines):
+    # Write one order to an open text file. lines is a DataFrame from order_lines()
+    # or an iterable of them, so very large orders can be streamed chunk by chunk.
+    file.write(';'.join(header) + '\n')
+    chunks = [lines] if isinstance(lines, pd.DataFrame) else lines
+    for chunk in chunks:
+        _write_lines(file, chunk)
+
+
+@contextmanager
+def atomic_open(path):
+    # Buffered text file written under a temporary name next to path and renamed
+    # over it once the block succeeds, so a reader (or the ERP import) never sees
+    # a partial file; the temporary file is removed when the block fails
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'x', newline='', buffering=WRITE_BUFFER_SIZE) as file:
+            yield file
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def open_output(output_file):
+    # A path is written atomically; any other target is an order of a consolidated
+    # file (finalities.bundle.BundleOrder) and collects the records in memory
+    if isinstance(output_file, (str, os.PathLike)):
+        return atomic_open(output_file)
+    return output_file.open()
+
+
+def write_order(output_file, header, lines):
+    # Write one order's Sage file through a single buffered handle
+    with metrics.timer('csv_write'), open_output(output_file) as file:
+        write_records(file, header, lines)
+    return output_file
+
+
+class LineSpool:
+    # Holds the L records of an order while they are produced, for orders whose
+    # E record is only known once the whole PDF was read. Records stay in memory
+    # up to max_memory bytes and move to a temporary file beyond that.
+
+    def __init__(self, max_memory=SPOOL_MEMORY):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory, mode='w+', newline='')
+        self.lines = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, lines):
+        with metrics.timer('csv_write'):
+            _write_lines(self.file, lines)
+        self.lines += len(lines)
+
+    def write_order(self, output_file, header):
+        # Write the E record then copy the spooled L records after it
+        with metrics.timer('csv_write'), open_output(output_file) as file:
+            file.write(';'.join(header) + '\n')
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, file, WRITE_BUFFER_SIZE)
+        return output_file
+
+    def close(self):
+        self.file.close()
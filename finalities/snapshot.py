@@ -0,0 +1,249 @@
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT = os.path.join(os.path.expanduser('~'), '.cache', 'finalities', 'reference.snapshot')
+
+# File layout: MAGIC, the header size (8 bytes, little-endian), the JSON header
+# padded to 8 bytes, then the sections it lists, each 8-byte aligned
+MAGIC = b'FINSNAP1'
+FORMAT = 1
+ALIGN = 8
+
+# EANs of up to this many digits are stored as integer keys (see ean_key), the
+# others in the header
+MAX_KEY_DIGITS = 17
+
+
+def ean_key(ean):
+    # Integer key of a normalized EAN (products.normalize_ean): length * 10**18 +
+    # value, so '0611...' and '611...' stay apart and keys of one length sort like
+    # the EANs. None for EANs that are not short digit strings.
+    if ean and len(ean) <= MAX_KEY_DIGITS and ean.isascii() and ean.isdigit():
+        return len(ean) * 10 ** 18 + int(ean)
+    return None
+
+
+class StringTable:
+    # Sequence of strings stored as offsets into one UTF-8 blob, decoded on access
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return str(self.blob[self.offsets[position]:self.offsets[position + 1]], 'utf-8')
+
+    def tolist(self):
+        blob = bytes(self.blob)
+        offsets = self.offsets.tolist()
+        return [blob[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+
+class ProductTable:
+    # EAN -> UID map of a snapshot, searched in place in the mapped file: a sorted
+    # array of EAN keys and the UIDs in the same order
+
+    def __init__(self, keys, uids, extra):
+        self.keys = keys
+        self.uids = uids
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.keys) + len(self.extra)
+
+    def get(self, ean, default=None):
+        key = ean_key(ean)
+        if key is None:
+            return self.extra.get(ean, default)
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return self.uids[position]
+        return default
+
+    def lookup(self, eans):
+        # {EAN: UID} of the given normalized EANs that are in the table
+        found = {}
+        for ean in eans:
+            uid = self.get(ean)
+            if uid is not None:
+                found[ean] = uid
+        return found
+
+
+class Snapshot:
+    # Read-only reference snapshot written by write_snapshot(). The file is
+    # memory-mapped, so every process opening it shares the same pages and reads
+    # nothing up front: EANs are looked up in the mapped arrays, and the clients,
+    # already split and normalized, only need decoding into the ClientIndex
+    # lists. versions holds the row count / max key of each table at export time,
+    # in the form ReferenceCache compares with the database.
+
+    def __init__(self, path=DEFAULT_SNAPSHOT):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a reference snapshot")
+        (header_size,) = struct.unpack_from('<Q', self.map, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.map[start:start + header_size])
+        if self.header['format'] != FORMAT or self.header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written in another snapshot format or byte order")
+        self.body = memoryview(self.map)[start + header_size:]
+        self.created = self.header['created']
+        self.versions = {table: tuple(version) for table, version in self.header['versions'].items()}
+        self.products = ProductTable(self.section('product_keys', 'Q'), self.strings('product_uids'),
+                                     self.header['extra_products'])
+
+    def section(self, name, typecode='B'):
+        offset, length = self.header['sections'][name]
+        return self.body[offset:offset + length].cast(typecode)
+
+    def strings(self, name):
+        return StringTable(self.section(name + '.offsets', 'Q'), self.section(name + '.blob'))
+
+    def stale_tables(self, versions):
+        # Tables whose database version differs from the snapshot's
+        return [table for table, version in versions.items() if self.versions.get(table) != tuple(version)]
+
+    def prepared_clients(self):
+        # (dens, uids, stores, blocks, version) for ClientIndex(prepared=...)
+        positions = self.section('block_positions', 'Q').tolist()
+        starts = self.section('block_starts', 'Q').tolist()
+        blocks = {city: positions[start:end]
+                  for city, start, end in zip(self.strings('cities').tolist(), starts, starts[1:])}
+        return (self.strings('client_dens').tolist(), self.strings('client_uids').tolist(),
+                self.strings('client_stores').tolist(), blocks, self.header['clients_version'])
+
+
+def open_snapshot(path=DEFAULT_SNAPSHOT):
+    # The snapshot at path, None when there is none or it cannot be read
+    if not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError):
+        logger.warning("Ignoring reference snapshot %s", path, exc_info=True)
+        return None
+
+
+def _string_table(strings):
+    encoded = [text.encode() for text in strings]
+    offsets = array('Q', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    return offsets.tobytes(), b''.join(encoded)
+
+
+def write_snapshot(path, products, clients, versions):
+    # Write the {EAN: UID} products map, the clients as prepared by
+    # stores.prepare_clients() and the table versions they were read at. The file
+    # is replaced atomically, so processes that mapped the previous one keep it.
+    keyed = sorted((ean_key(ean), uid) for ean, uid in products.items() if ean_key(ean) is not None)
+    extra = {ean: uid for ean, uid in products.items() if ean_key(ean) is None}
+    dens, uids, stores, blocks, clients_version = clients
+    sections = {'product_keys': array('Q', [key for key, _ in keyed]).tobytes()}
+    string_tables = {'product_uids': [uid for _, uid in keyed], 'client_dens': dens, 'client_uids': uids,
+                     'client_stores': stores, 'cities': list(blocks)}
+    for name, strings in string_tables.items():
+        sections[name + '.offsets'], sections[name + '.blob'] = _string_table(strings)
+    starts = array('Q', [0])
+    for positions in blocks.values():
+        starts.append(starts[-1] + len(positions))
+    sections['block_starts'] = starts.tobytes()
+    sections['block_positions'] = array('Q', [position for positions in blocks.values() for position in positions]).tobytes()
+
+    body = bytearray()
+    layout = {}
+    for name, data in sections.items():
+        layout[name] = [len(body), len(data)]
+        body += data + b'\0' * (-len(data) % ALIGN)
+    header = json.dumps({
+        'format': FORMAT,
+        'byteorder': sys.byteorder,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'versions': {table: [str(value) for value in version] for table, version in versions.items()},
+        'clients_version': clients_version,
+        'counts': {'products': len(products), 'clients': len(uids)},
+        'extra_products': extra,
+        'sections': layout,
+    }).encode()
+    header += b' ' * (-len(header) % ALIGN)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'xb') as file:
+            file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            file.write(body)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def export_snapshot(path=DEFAULT_SNAPSHOT, pool=None):
+    # Read products and clients from the database and write them as a snapshot
+    from finalities.refcache import ReferenceCache
+
+    cache = ReferenceCache(pool, memo=None)
+    products = cache.products()
+    clients = cache.prepared_clients()
+    return write_snapshot(path, products, clients, cache.versions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the reference tables to a memory-mapped snapshot")
+    parser.add_argument('--snapshot', default=DEFAULT_SNAPSHOT, help="Snapshot file")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('export', help="Write the products and clients tables to the snapshot")
+    commands.add_parser('info', help="Show the snapshot's contents and whether the database changed since")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        snapshot = Snapshot(export_snapshot(args.snapshot))
+        counts = snapshot.header['counts']
+        print(f"Wrote {snapshot.path}: {counts['products']} products, {counts['clients']} clients, "
+              f"{len(snapshot.map) / 1024 / 1024:.1f} MB")
+        return 0
+
+    snapshot = open_snapshot(args.snapshot)
+    if snapshot is None:
+        print(f"No reference snapshot at {args.snapshot}")
+        return 1
+    counts = snapshot.header['counts']
+    print(f"{snapshot.path}: exported {snapshot.created}, {counts['products']} products, {counts['clients']} clients")
+    from finalities.refcache import ReferenceCache
+
+    try:
+        versions = ReferenceCache(memo=None).live_versions()
+    except Exception as error:
+        print(f"Database unavailable ({type(error).__name__}: {error}), cannot check freshness")
+        return 1
+    stale = snapshot.stale_tables(versions)
+    if stale:
+        print(f"Stale: {', '.join(stale)} changed since the export, run 'finalities snapshot export'")
+        return 1
+    print("Current with the database")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,190 @@
+import hashlib
+import re
+
+from finalities import metrics
+from finalities.matchmemo import ALIAS_SCORE, normalize_store
+
+# Words that retailers add to store names but that never appear in clients.Den
+NOISE_WORDS = ("market", "medina")
+
+# fuzzywuzzy modules, imported when the first ClientIndex is built
+fuzz = utils = None
+
+
+def _load_fuzzywuzzy():
+    global fuzz, utils
+    if fuzz is None:
+        from fuzzywuzzy import fuzz, utils
+
+
+def split_store_city(text):
+    # Split store name and city name: the first word is the store, the rest is the city
+    parts = re.split(r'\s+', text, maxsplit=1)
+    store = parts[0]
+    city = parts[1] if len(parts) > 1 else ''
+    return store, city
+
+
+def strip_noise_words(text, words=NOISE_WORDS):
+    for word in words:
+        text = re.sub(r'\b{}\b'.format(word), '', text, flags=re.IGNORECASE).strip()
+    return text
+
+
+def _process(text):
+    # Same normalization fuzzywuzzy applies inside process.extractOne / fuzz.WRatio
+    return utils.full_process(text, force_ascii=True)
+
+
+def trigrams(text):
+    # Trigrams of each word of a normalized text, padded by one space: 'fes' gives
+    # ' fe', 'fes', 'es '
+    grams = set()
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+def gram_index(keys):
+    # Trigram -> keys having it
+    index = {}
+    for key in keys:
+        for gram in trigrams(key):
+            index.setdefault(gram, []).append(key)
+    return index
+
+
+def prepare_clients(entries):
+    # Split and normalize every Den once: (dens, uids, normalized stores, blocks of
+    # entry positions by normalized city in table order, sha1 of the rows)
+    _load_fuzzywuzzy()
+    dens, uids, stores, blocks = [], [], [], {}
+    digest = hashlib.sha1()
+    for entry in entries:
+        db_store, db_city = split_store_city(entry['Den'])
+        dens.append(entry['Den'])
+        uids.append(entry['UID'])
+        stores.append(_process(db_store))
+        blocks.setdefault(_process(db_city), []).append(len(dens) - 1)
+        digest.update(f"{entry['UID']}\t{entry['Den']}\n".encode())
+    return dens, uids, stores, blocks, digest.hexdigest()
+
+
+class ClientIndex:
+    # Prebuilt index over the clients table for store-name matching.
+    #
+    # Every Den is split and normalized once. Entries are blocked by their
+    # normalized city, and distinct store names are scored only once per query.
+    # Trigram inverted indexes over the cities and the store names pick the
+    # candidates: only the city blocks sharing a trigram with the query's city
+    # are scored. A query without a city (or whose city shares none) falls back
+    # to the blocks of the stores sharing a trigram with its store, and to every
+    # block when that finds nothing either. Candidate cities are scored first;
+    # since the store score is at most 100, a block whose (100 + city score) / 2
+    # is below the best score found so far cannot hold a better match and is
+    # skipped. Among the candidates the result is the best match of the old
+    # linear find_closest_match scan (earliest entry wins ties); a client whose
+    # city shares no trigram with the query's is not considered.
+    #
+    # With a MatchMemo, a store text matched before (by any process, against the
+    # same clients) or aliased by an operator is answered without scoring. The
+    # memo is bound to a hash of the clients rows, so any change to the table
+    # discards the memoized matches.
+
+    def __init__(self, entries, noise_words=(), memo=None, prepared=None):
+        # prepared: (dens, uids, stores, blocks, version) of clients split and
+        # normalized beforehand by prepare_clients(), e.g. read from a reference
+        # snapshot (finalities.snapshot); entries is then ignored
+        _load_fuzzywuzzy()
+        self.noise_words = tuple(noise_words)
+        self.dens, self.uids, self.stores, self.blocks, self.version = prepared or prepare_clients(entries)
+        self.positions = {uid: position for position, uid in reversed(list(enumerate(self.uids)))}
+        self.city_grams = gram_index(self.blocks)
+        self.store_cities = {}
+        for city, positions in self.blocks.items():
+            for position in positions:
+                self.store_cities.setdefault(self.stores[position], set()).add(city)
+        self.store_grams = gram_index(self.store_cities)
+        self.memo = memo
+        self.memo_noise = ','.join(word.lower() for word in self.noise_words)
+        if memo is not None:
+            memo.bind(self.version)
+        self.candidates_scored = 0
+
+    def __len__(self):
+        return len(self.dens)
+
+    def match(self, input_text):
+        # Return (Den, UID, score) of the best matching client, or (None, None, 0)
+        if self.memo is not None:
+            query = normalize_store(input_text)
+            uid = self.memo.alias(query)
+            if uid in self.positions:
+                metrics.count('fuzzy_memo_hits')
+                return self.dens[self.positions[uid]], uid, ALIAS_SCORE
+            result = self.memo.get(self.memo_noise, query)
+            if result is not None:
+                metrics.count('fuzzy_memo_hits')
+                return result
+        scored_before = self.candidates_scored
+        with metrics.timer('fuzzy_match'):
+            result = self._match(input_text)
+        metrics.count('fuzzy_queries')
+        metrics.count('fuzzy_candidates', self.candidates_scored - scored_before)
+        if self.memo is not None:
+            self.memo.put(self.memo_noise, query, result)
+        return result
+
+    def _match(self, input_text):
+        input_store, input_city = split_store_city(input_text)
+        if self.noise_words:
+            input_store = strip_noise_words(input_store, self.noise_words)
+        query_store = _process(input_store)
+        query_city = _process(input_city)
+
+        city_scores = sorted(((fuzz.WRatio(query_city, city), city) for city in self._candidate_cities(query_city, query_store)),
+                             reverse=True)
+        store_scores = {}
+        best_position = None
+        highest_score = 0
+
+        for city_score, city in city_scores:
+            if (100 + city_score) / 2 < highest_score:
+                break
+            for position in self.blocks[city]:
+                db_store = self.stores[position]
+                if db_store not in store_scores:
+                    store_scores[db_store] = fuzz.WRatio(query_store, db_store)
+                    self.candidates_scored += 1
+                score = (store_scores[db_store] + city_score) / 2
+                if score > highest_score or (score == highest_score and best_position is not None
+                                             and score > 0 and position < best_position):
+                    highest_score = score
+                    best_position = position
+
+        if best_position is None:
+            return None, None, 0
+        return self.dens[best_position], self.uids[best_position], highest_score
+
+    def _candidate_cities(self, query_city, query_store):
+        # City blocks worth scoring for a query, see the class comment
+        cities = {city for gram in trigrams(query_city) for city in self.city_grams.get(gram, ())}
+        if not cities:
+            cities = {city for gram in trigrams(query_store) for store in self.store_grams.get(gram, ())
+                      for city in self.store_cities[store]}
+        return cities or self.blocks
+
+    def match_many(self, names, score_cutoff=None):
+        # Match a batch of store names; repeated names are scored once.
+        # Matches scoring below score_cutoff are returned as (None, None, score).
+        results = {}
+        matches = []
+        for name in names:
+            if name not in results:
+                den, uid, score = self.match(name)
+                if score_cutoff is not None and score < score_cutoff:
+                    den, uid = None, None
+                results[name] = (den, uid, score)
+            matches.append(results[name])
+        return matches
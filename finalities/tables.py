@@ -0,0 +1,41 @@
+import pandas as pd
+
+
+class TableAccumulator:
+    # Collects the pieces of each table type while pages are read and builds
+    # every DataFrame once at the end. Row lists (pdfplumber) and DataFrame
+    # chunks (tabula) are only appended to lists, so a long order costs one
+    # copy per table instead of one pd.concat of the whole table per page.
+
+    def __init__(self, columns=None, dtypes=None):
+        self.columns = {name: list(header) for name, header in (columns or {}).items()}
+        self.dtypes = dtypes or {}
+        self.rows = {}
+        self.chunks = {}
+
+    def add_rows(self, name, header, rows, replace=False):
+        # Add raw rows under the given header; replace=True keeps only the latest table
+        self.columns.setdefault(name, list(header))
+        if replace or name not in self.rows:
+            self.rows[name] = []
+        self.rows[name].extend(rows)
+
+    def add_frame(self, name, df):
+        self.columns.setdefault(name, list(df.columns))
+        self.chunks.setdefault(name, []).append(df)
+
+    def build(self):
+        # Build each table once, with the declared dtypes applied
+        tables = {}
+        for name, header in self.columns.items():
+            if name in self.rows:
+                df = pd.DataFrame(self.rows[name], columns=header)
+            elif name in self.chunks:
+                df = pd.concat(self.chunks[name], ignore_index=True)
+            else:
+                df = pd.DataFrame(columns=header)
+            dtypes = {column: dtype for column, dtype in self.dtypes.get(name, {}).items() if column in df.columns}
+            tables[name] = df.astype(dtypes) if dtypes else df
+        self.rows = {}
+        self.chunks = {}
+        return tables
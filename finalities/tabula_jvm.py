@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from finalities import metrics
+
+logger = logging.getLogger(__name__)
+
+# tabula (and pandas with it) is imported on first use, so importing a parser
+# costs nothing until a PDF is read.
+#
+# The warm JVM comes from tabula-py itself: since 2.10, when jpype is installed,
+# its first call starts one JVM inside the process and every later call reuses
+# it, so each batch worker pays the JVM startup once. Without jpype tabula-py
+# starts one java subprocess per call, which read_pdfs() below brings down to
+# one call for several PDFs.
+
+# read_pdf() options that only concern how the results are read back in Python
+READ_OPTIONS = ('multiple_tables', 'encoding', 'pandas_options')
+
+_warned = False
+# (PDF, options) -> tables read ahead by read_pdfs(), handed out once by read_pdf()
+_prefetched = {}
+
+
+def backend():
+    # 'jpype' when tabula calls run in the process's JVM, 'subprocess' otherwise
+    global _warned
+    try:
+        import jpype  # noqa: F401
+    except ImportError:
+        if not _warned:
+            logger.warning("jpype is not installed, tabula will start a Java subprocess per call")
+            _warned = True
+        return 'subprocess'
+    return 'jpype'
+
+
+def _key(pdf_path, kwargs):
+    return os.path.abspath(pdf_path), json.dumps(kwargs, sort_keys=True, default=str)
+
+
+def read_pdf(pdf_path, **kwargs):
+    # tabula.read_pdf, timed and counted in the extraction metrics. Tables read
+    # ahead for this PDF with the same options by read_pdfs() are returned instead.
+    tables = _prefetched.pop(_key(pdf_path, kwargs), None)
+    if tables is not None:
+        metrics.count('tabula_batched')
+    else:
+        import tabula
+
+        backend()
+        with metrics.timer('table_extraction'):
+            tables = tabula.read_pdf(pdf_path, **kwargs)
+    metrics.count('tables', len(tables))
+    return tables
+
+
+def _frames(raw_tables, pandas_options):
+    # DataFrames of tabula-java's JSON output for one PDF, one per table, each
+    # read back with pd.read_csv; columns are made numeric where they can be, as
+    # read_pdf() does (empty tables included)
+    import pandas as pd
+
+    frames = []
+    for table in raw_tables:
+        if not table['data']:
+            continue
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([cell['text'] for cell in row] for row in table['data'])
+        buffer.seek(0)
+        frame = pd.read_csv(buffer, **pandas_options)
+        if not pandas_options.get('dtype'):
+            for column in frame.columns:
+                try:
+                    frame[column] = pd.to_numeric(frame[column])
+                except (ValueError, TypeError):
+                    pass
+        frames.append(frame)
+    return frames
+
+
+def read_pdfs(pdf_paths, **kwargs):
+    # Read the tables of several PDFs with one tabula-java call (its --batch mode
+    # over a directory of links to them), with the options of read_pdf().
+    # Returns {pdf_path: [DataFrame, ...]}; a PDF tabula-java could not read is
+    # left out, for read_pdf() to try on its own.
+    import tabula
+
+    options = {name: value for name, value in kwargs.items() if name not in READ_OPTIONS}
+    pandas_options = dict(kwargs.get('pandas_options') or {})
+    if not kwargs.get('multiple_tables', True):
+        raise ValueError("read_pdfs() returns every table separately, multiple_tables=False is not supported")
+    # tabula-java writes UTF-8. read_pdf() decodes a subprocess's output with
+    # the encoding option, so the files are read the same way to give the same text.
+    encoding = kwargs.get('encoding', 'utf-8') if backend() == 'subprocess' else 'utf-8'
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='tabula-batch-')
+    try:
+        names = {}
+        for position, pdf_path in enumerate(pdf_paths):
+            name = f"{position:06d}"
+            os.symlink(os.path.abspath(pdf_path), os.path.join(work_dir, name + '.pdf'))
+            names[name] = pdf_path
+        with metrics.timer('table_extraction'):
+            tabula.convert_into_by_batch(work_dir, output_format='json', **options)
+        for name, pdf_path in names.items():
+            try:
+                with open(os.path.join(work_dir, name + '.json'), encoding=encoding) as file:
+                    results[pdf_path] = _frames(json.load(file), pandas_options)
+            except (OSError, ValueError):
+                logger.warning("tabula batch gave no tables for %s", pdf_path, exc_info=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def prefetch(pdf_paths, **kwargs):
+    # Read several PDFs with read_pdfs() ahead of the read_pdf() calls that will
+    # ask for them with the same options. Returns the number of PDFs read ahead;
+    # when the batch call fails, none are and each read_pdf() reads its own PDF.
+    if not pdf_paths:
+        return 0
+    try:
+        results = read_pdfs(pdf_paths, **kwargs)
+    except Exception:
+        logger.warning("tabula batch read of %d PDFs failed, reading them one by one", len(pdf_paths), exc_info=True)
+        return 0
+    for pdf_path, tables in results.items():
+        _prefetched[_key(pdf_path, kwargs)] = tables
+    return len(results)
+
+
+def discard_prefetched():
+    _prefetched.clear()
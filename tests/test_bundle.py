@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from finalities.bundle import SageBundle
+from finalities.normalize import write_rejects
+from finalities.sage import order_header, order_lines, write_order
+
+
+def export(bundle, order_ref, lines=1, rejects=None, **info):
+    header = order_header(BPCORD='C1', ORDDAT='20240115', CUSORDREF=order_ref)
+    with bundle.order(f"{order_ref}.csv", order_ref=order_ref, **info) as target:
+        write_order(target, header, order_lines([f"ITM{number}" for number in range(lines)], ['1'] * lines))
+        if rejects is not None:
+            write_rejects(target, header, rejects)
+    return target
+
+
+def manifest(bundle):
+    with open(bundle.manifest_path) as file:
+        return json.load(file)
+
+
+def test_orders_are_packed_into_files(tmp_path):
+    with SageBundle(str(tmp_path), prefix='sage', max_orders=2) as bundle:
+        targets = [export(bundle, f"PO{number}", lines=number + 1) for number in range(3)]
+    assert sorted(os.listdir(tmp_path)) == ['sage.manifest.json', 'sage_0001.csv', 'sage_0002.csv']
+    assert [target.path for target in targets] == [str(tmp_path / 'sage_0001.csv')] * 2 + [str(tmp_path / 'sage_0002.csv')]
+    records = (tmp_path / 'sage_0001.csv').read_text().splitlines()
+    assert [record.split(';')[0] for record in records] == ['E', 'L', 'E', 'L', 'L']
+
+    written = manifest(bundle)
+    assert written['complete'] is True
+    assert written['orders'] == 3
+    assert [(entry['file'], entry['orders'], entry['lines']) for entry in written['files']] == [
+        ('sage_0001.csv', 2, 3), ('sage_0002.csv', 1, 3)]
+    for entry in written['files']:
+        data = (tmp_path / entry['file']).read_bytes()
+        assert (entry['bytes'], entry['sha256']) == (len(data), hashlib.sha256(data).hexdigest())
+    assert [order['CUSORDREF'] for order in written['files'][0]['contents']] == ['PO0', 'PO1']
+
+
+def test_max_bytes_starts_a_new_file(tmp_path):
+    with SageBundle(str(tmp_path), prefix='sage', max_bytes=100) as bundle:
+        export(bundle, 'PO1')
+        export(bundle, 'PO2')
+    assert [entry['orders'] for entry in manifest(bundle)['files']] == [1, 1]
+
+
+def test_failed_order_leaves_nothing_in_the_bundle(tmp_path):
+    with SageBundle(str(tmp_path), prefix='sage') as bundle:
+        export(bundle, 'PO1')
+        with pytest.raises(ValueError):
+            with bundle.order('PO2.csv') as target:
+                target.buffer.write('E;partial\n')
+                raise ValueError('export failed')
+    assert [order['CUSORDREF'] for order in manifest(bundle)['files'][0]['contents']] == ['PO1']
+    assert (tmp_path / 'sage_0001.csv').read_text().count('E;') == 1
+
+
+def test_interrupted_run_keeps_manifest_incomplete(tmp_path):
+    with pytest.raises(KeyboardInterrupt):
+        with SageBundle(str(tmp_path), prefix='sage') as bundle:
+            export(bundle, 'PO1')
+            raise KeyboardInterrupt
+    written = manifest(bundle)
+    assert written['complete'] is False
+    assert written['orders'] == 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_empty_bundle_writes_nothing(tmp_path):
+    with SageBundle(str(tmp_path), prefix='sage'):
+        pass
+    assert os.listdir(tmp_path) == []
+
+
+def test_rejects_go_next_to_the_file(tmp_path):
+    rejects = pd.DataFrame({'LINE': [2], 'EAN': ['123'], 'ITMREF': [''], 'QTY': ['1'], 'REASON': ['unknown EAN']})
+    with SageBundle(str(tmp_path), prefix='sage') as bundle:
+        export(bundle, 'PO1', rejects=rejects)
+        export(bundle, 'PO2')
+    entry = manifest(bundle)['files'][0]
+    assert (entry['rejected_lines'], entry['rejects']) == (1, 'sage_0001.rejects.csv')
+    report = pd.read_csv(tmp_path / 'sage_0001.rejects.csv', sep=';', dtype=str)
+    assert report[['CUSORDREF', 'EAN', 'REASON']].values.tolist() == [['PO1', '123', 'unknown EAN']]
+
+
+def test_on_flush_gets_the_written_orders(tmp_path):
+    flushed = []
+    with SageBundle(str(tmp_path), prefix='sage', on_flush=lambda path, orders: flushed.append(
+            (path, os.path.exists(path), [info['order_ref'] for info in orders]))) as bundle:
+        export(bundle, 'PO1')
+        export(bundle, 'PO2')
+    assert flushed == [(str(tmp_path / 'sage_0001.csv'), True, ['PO1', 'PO2'])]
+
+
+def test_new_prefix_does_not_reuse_a_run(tmp_path):
+    with SageBundle(str(tmp_path)) as first:
+        export(first, 'PO1')
+    second = SageBundle(str(tmp_path))
+    assert second.prefix != first.prefix
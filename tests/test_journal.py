@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+from finalities import batch
+from finalities.bundle import SageBundle
+from finalities.journal import Journal
+from finalities.sage import order_header, order_lines, write_order
+
+
+class FakeParser:
+    # Writes a one-line order for whatever tables it is given
+    def __init__(self):
+        self.exported = []
+
+    def export_order(self, tables, output, reference_cache, debug_dir=None):
+        self.exported.append(str(output))
+        header = order_header(BPCORD='C1', ORDDAT='20240115', CUSORDREF=tables['order_ref'])
+        return write_order(output, header, order_lines(['ITM1'], ['1']))
+
+
+@pytest.fixture
+def parser(monkeypatch):
+    parser = FakeParser()
+    monkeypatch.setattr(batch, 'get_parser', lambda retailer: parser)
+    return parser
+
+
+@pytest.fixture
+def journal(tmp_path):
+    with Journal(str(tmp_path / 'journal.sqlite')) as journal:
+        yield journal
+
+
+def extracted(order_ref, error=None):
+    return {'retailer': 'marjane', 'order_ref': order_ref, 'tables': {'order_ref': order_ref}, 'error': error,
+            'cached': False, 'seconds': 0.0, 'metrics': {}}
+
+
+def make_pdf(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as file:
+        file.write(content)
+    return path
+
+
+def test_find_order_only_matches_exported_orders(journal):
+    journal.record('h1', 'a.pdf', 'failed', 'marjane', 'PO1', error='boom')
+    assert journal.find_order('marjane', 'PO1') is None
+    journal.record('h2', 'b.pdf', 'ok', 'marjane', 'PO1', 'b.csv')
+    assert journal.find_order('marjane', 'PO1')['file'] == 'b.pdf'
+    assert journal.find_order('labelvie', 'PO1') is None
+    assert journal.find_order('marjane', '') is None
+
+
+def test_record_replaces_the_row_of_a_file(journal):
+    journal.record('h1', 'a.pdf', 'failed', 'marjane', 'PO1', error='boom')
+    journal.record('h1', 'a.pdf', 'ok', 'marjane', 'PO1', 'a.csv')
+    row = journal.find_file('h1')
+    assert (row['status'], row['output'], row['error']) == ('ok', 'a.csv', '')
+    assert journal.find_file('h2') is None
+
+
+def test_journal_survives_reopening(tmp_path):
+    path = str(tmp_path / 'journal.sqlite')
+    with Journal(path) as journal:
+        journal.record('h1', 'a.pdf', 'ok', 'marjane', 'PO1', 'a.csv')
+    with Journal(path) as journal:
+        assert journal.find_order('marjane', 'PO1')['file_hash'] == 'h1'
+
+
+def test_export_skips_po_converted_from_another_pdf(tmp_path, parser, journal):
+    first = batch.export_extracted(extracted('PO1'), 'a.pdf', str(tmp_path), None, journal=journal, file_hash='h1')
+    assert first['status'] == 'ok'
+    second = batch.export_extracted(extracted('PO1'), 'b.pdf', str(tmp_path), None, journal=journal, file_hash='h2')
+    assert second['status'] == 'duplicate'
+    assert second['output'] == first['output']
+    assert 'a.pdf' in second['error']
+    assert parser.exported == [first['output']]
+    assert journal.find_file('h2')['status'] == 'duplicate'
+
+
+def test_export_converts_same_pdf_again(tmp_path, parser, journal):
+    batch.export_extracted(extracted('PO1'), 'a.pdf', str(tmp_path), None, journal=journal, file_hash='h1')
+    again = batch.export_extracted(extracted('PO1'), 'a.pdf', str(tmp_path), None, journal=journal, file_hash='h1')
+    assert again['status'] == 'ok'
+    assert len(parser.exported) == 2
+
+
+def test_export_records_failures_for_retry(tmp_path, parser, journal):
+    entry = batch.export_extracted(extracted('PO1', error='Traceback\nValueError: unreadable\n'), 'a.pdf',
+                                   str(tmp_path), None, journal=journal, file_hash='h1')
+    assert entry['status'] == 'failed'
+    assert journal.find_file('h1')['status'] == 'failed'
+    assert journal.find_order('marjane', 'PO1') is None
+
+
+def test_export_skips_po_pending_in_bundle(tmp_path, parser, journal):
+    output_dir = str(tmp_path / 'out')
+    with SageBundle(output_dir, prefix='sage', on_flush=lambda path, orders: batch.record_bundled(journal, path, orders)) as bundle:
+        first = batch.export_extracted(extracted('PO1'), 'a.pdf', output_dir, None, journal=journal, file_hash='h1',
+                                       bundle=bundle)
+        second = batch.export_extracted(extracted('PO1'), 'b.pdf', output_dir, None, journal=journal, file_hash='h2',
+                                        bundle=bundle)
+        assert journal.find_file('h1') is None  # journaled once its file is written
+    assert (first['status'], second['status']) == ('ok', 'duplicate')
+    assert second['output'] == first['output'] == os.path.join(output_dir, 'sage_0001.csv')
+    assert journal.find_file('h1')['output'] == first['output']
+    assert journal.find_order('marjane', 'PO1')['file'] == 'a.pdf'
+
+
+def test_prepass_skips_completed_pdfs_and_repeats(tmp_path, journal):
+    done = make_pdf(tmp_path, 'done.pdf', b'done')
+    failed = make_pdf(tmp_path, 'failed.pdf', b'failed')
+    new = make_pdf(tmp_path, 'new.pdf', b'new')
+    copy = make_pdf(tmp_path, 'copy.pdf', b'new')
+    journal.record(batch.content_hash(done), done, 'ok', 'marjane', 'PO1', 'done.csv')
+    journal.record(batch.content_hash(failed), failed, 'failed', 'marjane', 'PO2', error='boom')
+
+    skipped, pending, hashes = batch.journal_prepass(journal, [done, failed, new, copy], 'marjane')
+    assert pending == [failed, new]
+    assert set(hashes) == {failed, new}
+    assert [(entry['file'], entry['status']) for entry in skipped] == [(done, 'skipped'), (copy, 'duplicate')]
+    assert skipped[0]['output'] == 'done.csv'
+    assert new in skipped[1]['error']
+
+
+def test_prepass_without_journal_converts_everything(tmp_path):
+    pdfs = [make_pdf(tmp_path, 'a.pdf', b'a'), make_pdf(tmp_path, 'b.pdf', b'a')]
+    assert batch.journal_prepass(None, pdfs, 'marjane') == ([], pdfs, {})
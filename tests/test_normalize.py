@@ -0,0 +1,61 @@
+import os
+
+import pandas as pd
+import pytest
+
+from finalities.normalize import (check_lines_left, normalize_lines, quantities, rejects_path, sage_date, sage_dates,
+                                  write_rejects)
+from finalities.sage import order_header, order_lines
+
+HEADER = order_header(BPCORD='C1', ORDDAT='20240115', CUSORDREF='PO1')
+
+
+def test_quantities():
+    values = quantities(['50', '50.000', '1 200', '12,5', '', None, 'abc', 7])
+    assert values.tolist()[:4] == [50.0, 50.0, 1200.0, 12.5]
+    assert values.iloc[4:7].isna().all()
+    assert values.iloc[7] == 7.0
+
+
+def test_sage_dates():
+    assert sage_dates(['15/01/2024', 'not a date', None], '%d/%m/%Y').tolist() == ['20240115', '', '']
+    assert sage_date('15/01/2409:30', '%d/%m/%y%H:%M') == '20240115'
+
+
+def test_normalize_lines_sets_apart_rejected_lines():
+    lines = order_lines(['ITM1', '', 'ITM3', None, 'ITM5'], ['12.000', '3', '0', 'x', '1 200'])
+    kept, rejects = normalize_lines(lines, eans=['e1', 'e2', 'e3', 'e4', 'e5'], first_line=10)
+    assert kept[['ITMREF', 'QTY']].values.tolist() == [['ITM1', '12'], ['ITM5', '1200']]
+    assert rejects[['LINE', 'EAN', 'REASON']].values.tolist() == [
+        [11, 'e2', 'unknown EAN'], [12, 'e3', 'bad quantity'], [13, 'e4', 'unknown EAN, bad quantity']]
+
+
+def test_normalize_lines_keeps_fractional_quantities():
+    kept, rejects = normalize_lines(order_lines(['ITM1'], ['2,5']))
+    assert kept['QTY'].tolist() == ['2.5']
+    assert rejects.empty
+
+
+def test_write_rejects_report(tmp_path):
+    output = str(tmp_path / 'order.csv')
+    _, rejects = normalize_lines(order_lines(['', 'ITM2'], ['1', '2']), eans=['0123', '0456'])
+    path = write_rejects(output, HEADER, rejects)
+    assert path == rejects_path(output) == str(tmp_path / 'order.rejects.csv')
+    report = pd.read_csv(path, sep=';', dtype=str, keep_default_na=False)
+    assert list(report.columns) == ['CUSORDREF', 'BPCORD', 'LINE', 'EAN', 'ITMREF', 'QTY', 'REASON']
+    assert report.values.tolist() == [['PO1', 'C1', '1', '0123', '', '1', 'unknown EAN']]
+
+
+def test_clean_rerun_removes_old_report(tmp_path):
+    output = str(tmp_path / 'order.csv')
+    _, rejects = normalize_lines(order_lines([''], ['1']), eans=['0123'])
+    write_rejects(output, HEADER, rejects)
+    _, rejects = normalize_lines(order_lines(['ITM1'], ['1']), eans=['0123'])
+    assert write_rejects(output, HEADER, rejects) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_order_without_lines_left_is_refused():
+    check_lines_left(1)
+    with pytest.raises(ValueError):
+        check_lines_left(0)
@@ -0,0 +1,111 @@
+import os
+
+import pandas as pd
+import pytest
+
+from finalities.sage import (E_FIELDS, L_FIELDS, LineSpool, SageSchemaError, atomic_open, order_header, order_lines,
+                             write_order)
+
+HEADER = dict(BPCORD='C0042', ORDDAT='20240115', CUSORDREF='PO123', EXPDATE='20240120')
+
+
+def read_records(path):
+    with open(path, newline='') as file:
+        return [line.split(';') for line in file.read().splitlines()]
+
+
+def test_order_header_fills_defaults_in_layout_order():
+    record = order_header(**HEADER)
+    assert len(record) == len(E_FIELDS)
+    assert dict(zip(E_FIELDS, record)) == dict(E='E', SALFCY='AL1', SOHTYP='SON', SOHNUM='', BPCORD='C0042',
+                                               ORDDAT='20240115', CUSORDREF='PO123', STOFCY='AL1',
+                                               EXPDATE='20240120', ADR='ADR')
+
+
+def test_order_header_writes_missing_values_empty():
+    record = dict(zip(E_FIELDS, order_header(BPCORD=None, ORDDAT='20240115', CUSORDREF=float('nan'))))
+    assert record['BPCORD'] == ''
+    assert record['CUSORDREF'] == ''
+    assert record['EXPDATE'] == ''
+
+
+@pytest.mark.parametrize('fields', [
+    dict(HEADER, CUSTOMER='C0042'),
+    dict(HEADER, CUSORDREF='PO;123'),
+    dict(HEADER, BPCORD='C00\n42'),
+    dict(HEADER, ORDDAT='15/01/2024'),
+    dict(HEADER, EXPDATE='2024012'),
+])
+def test_order_header_rejects_bad_fields(fields):
+    with pytest.raises(SageSchemaError):
+        order_header(**fields)
+
+
+def test_order_lines_layout():
+    lines = order_lines(pd.Series(['ITM1', None], index=[5, 7]), pd.Series(['12', '3']), sau='UN')
+    assert tuple(lines.columns) == L_FIELDS
+    assert lines.values.tolist() == [['L', 'ITM1', '', 'UN', '12', '', '', '', '', ''],
+                                     ['L', '', '', 'UN', '3', '', '', '', '', '']]
+
+
+def test_order_lines_rejects_length_mismatch():
+    with pytest.raises(SageSchemaError):
+        order_lines(['ITM1', 'ITM2'], ['1'])
+
+
+def test_write_order(tmp_path):
+    path = tmp_path / 'order.csv'
+    header = order_header(**HEADER)
+    write_order(str(path), header, order_lines(['ITM1', 'ITM2'], ['12', '3']))
+    assert read_records(path) == [header,
+                                  ['L', 'ITM1', '', 'CAR', '12', '', '', '', '', ''],
+                                  ['L', 'ITM2', '', 'CAR', '3', '', '', '', '', '']]
+
+
+def test_write_order_streams_chunks(tmp_path):
+    path = tmp_path / 'order.csv'
+    chunks = (order_lines([f"ITM{number}"], ['1']) for number in range(3))
+    write_order(str(path), order_header(**HEADER), chunks)
+    assert [record[1] for record in read_records(path)[1:]] == ['ITM0', 'ITM1', 'ITM2']
+
+
+def test_write_order_rejects_other_line_layouts(tmp_path):
+    path = tmp_path / 'order.csv'
+    lines = order_lines(['ITM1'], ['1']).drop(columns='L9')
+    with pytest.raises(SageSchemaError):
+        write_order(str(path), order_header(**HEADER), lines)
+    assert os.listdir(tmp_path) == []
+
+
+def test_atomic_open_keeps_previous_file_on_failure(tmp_path):
+    path = tmp_path / 'order.csv'
+    path.write_text('previous\n')
+    with pytest.raises(RuntimeError):
+        with atomic_open(str(path)) as file:
+            file.write('partial')
+            raise RuntimeError('export failed')
+    assert path.read_text() == 'previous\n'
+    assert os.listdir(tmp_path) == ['order.csv']
+
+
+def test_atomic_open_replaces_file(tmp_path):
+    path = tmp_path / 'order.csv'
+    path.write_text('previous\n')
+    with atomic_open(str(path)) as file:
+        file.write('new\n')
+        assert path.read_text() == 'previous\n'
+    assert path.read_text() == 'new\n'
+    assert os.listdir(tmp_path) == ['order.csv']
+
+
+def test_line_spool_writes_header_before_lines(tmp_path):
+    path = tmp_path / 'order.csv'
+    header = order_header(**HEADER)
+    with LineSpool(max_memory=16) as spool:
+        spool.add(order_lines(['ITM1'], ['1']))
+        spool.add(order_lines(['ITM2', 'ITM3'], ['2', '3']))
+        spool.write_order(str(path), header)
+        assert spool.lines == 3
+    records = read_records(path)
+    assert records[0] == header
+    assert [record[1] for record in records[1:]] == ['ITM1', 'ITM2', 'ITM3']
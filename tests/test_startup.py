@@ -0,0 +1,27 @@
+import pytest
+
+from startup import BUDGETS, HEAVY, import_time
+
+# The budgets are tuned for a developer machine; CI runners get this much room
+SCALE = 2
+
+# Imported by the code that reads a PDF or matches a store, never at import time
+FIRST_USE_ONLY = ('tabula', 'jpype', 'fuzzywuzzy')
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_within_budget(module):
+    budget, allowed = BUDGETS[module]
+    milliseconds, packages = min(import_time(module) for _ in range(3))
+    assert milliseconds is not None, f"{module} does not appear in the -X importtime output"
+    assert milliseconds <= budget * SCALE, f"{module} took {milliseconds:.1f} ms, budget {budget * SCALE} ms"
+    unexpected = sorted(package for package in packages if package in HEAVY and package not in allowed)
+    assert not unexpected, f"{module} imports {', '.join(unexpected)}"
+
+
+@pytest.mark.parametrize('module', ['finalities.parsers.vracmarjane', 'finalities.parsers.marjane',
+                                    'finalities.parsers.labelvie', 'finalities.stores', 'finalities.tabula_jvm',
+                                    'finalities.batch', 'finalities.daemon', 'finalities.pipeline'])
+def test_heavy_dependencies_load_on_first_use(module):
+    _, packages = import_time(module)
+    assert not packages & set(FIRST_USE_ONLY), f"{module} imports {', '.join(sorted(packages & set(FIRST_USE_ONLY)))}"